@@ -24,6 +24,7 @@ from dotenv import load_dotenv
 import redis
 import uuid
 import threading
+from contextlib import asynccontextmanager
 from services.google_drive_service import GoogleDriveService, google_drive_service
 import urllib.parse
 load_dotenv()
@@ -97,7 +98,7 @@ class JobManager:
 
 job_manager = JobManager()
 
-from services.rag_service import answer_question_with_rag, score_contracts, compare_responses
+from services.rag_service import answer_question_with_rag, score_contracts, compare_responses, close_clients as close_rag_service_clients
 
 def process_score_contracts_sync(workspace_name: str, criterion: str, max_score: int, compare_chatgpt: bool, share_data_with_chatgpt: bool):
     """Shared function for processing score contracts that can be used by both endpoint and job worker."""
@@ -254,11 +255,12 @@ def process_vendor_job(job_id: str, payload: dict, service_func, mode: str):
 
 from services.helper_service import extract_criteria_from_jsonl
 from services.audit_service import perform_contract_audit, save_audit_results
-from services.legal_service import perform_legal_analysis, save_legal_results
+from services.legal_service import perform_legal_analysis, save_legal_results, close_clients as close_legal_service_clients
 # Keeping parse_single_documents for clarity if it's explicitly used for single files
 # from services.parser_service import parse_documents as parse_single_documents # NEW: Import parse_documents directly
 from services.parser_service import run_parsing_for_workspace # Keep original import for contracts/criteria
 from services.embedder_service import run_embedding_for_workspace, sync_embedder_manifest
+from services.query_cache import query_cache
 from services.prompt_generator_service import generate_ai_prompts
 from services.combined_evaluation_service import perform_combined_evaluation
 from services.vendor_recommendation_service import generate_vendor_recommendations, generate_enhanced_vendor_recommendations
@@ -278,8 +280,27 @@ from services.google_drive_service import GoogleDriveService
 
 workspace_gdrive_services: Dict[str, GoogleDriveService] = {}
 
+# Event loop serving FastAPI requests; the worker thread submits async jobs to it
+main_event_loop = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global main_event_loop, worker_thread
+    main_event_loop = asyncio.get_running_loop()
+    # Started here rather than at import, so processes that merely import this module
+    # (spawned parser workers, the reloader parent) don't run a second worker
+    logger.info("[Main] Starting Redis worker thread...")
+    worker_thread = threading.Thread(target=job_worker_loop, daemon=True, name="RedisWorker")
+    worker_thread.start()
+    logger.info(f"[Main] Redis worker thread started with ID: {worker_thread.ident}")
+    yield
+    main_event_loop = None
+    await close_legal_service_clients()
+    await close_rag_service_clients()
+
 # app = FastAPI(title="Allyin Compass API", root_path="/")
 app = FastAPI(
+    lifespan=lifespan,
     title="Allyin Compass API",
     description="AI-powered contract analysis and vendor recommendation platform",
     version="1.0.0",
@@ -1169,7 +1190,7 @@ async def get_prepopulated_prompts(workspace_name: str):
             return default_prompts
 
         # Generate AI prompts if docs exist
-        ai_generated_prompts = generate_ai_prompts(workspace_name, base_dir=PROJECT_ROOT)
+        ai_generated_prompts = await generate_ai_prompts(workspace_name, base_dir=PROJECT_ROOT)
         if ai_generated_prompts:
             return ai_generated_prompts[:10]
         else:
@@ -1199,6 +1220,8 @@ async def delete_workspace(workspace_name: str):
         if qclient.collection_exists(workspace_name):
             qclient.delete_collection(workspace_name)
             logger.info(f"Deleted Qdrant collection '{workspace_name}'.")
+        query_cache.invalidate(collection_to_delete)
+        query_cache.invalidate(workspace_name)
 
         shutil.rmtree(workspace_to_delete)
 
@@ -1486,7 +1509,7 @@ async def legal_analysis_endpoint(request: LegalRequest, async_mode: bool = Quer
         start_time = time.time()
         
         # Perform the legal analysis
-        legal_results = perform_legal_analysis(request.workspace_name)
+        legal_results = await perform_legal_analysis(request.workspace_name)
         
         response_time = time.time() - start_time
         
@@ -2318,7 +2341,8 @@ async def process_uploaded_documents_background(workspace_name: str, file_type:
 
         # Determine folder prefix based on file type
         folder_prefix = input_dir_map.get(file_type, "")
-        parse_documents(str(input_dir), str(output_file), workspace_name, use_manifest=use_manifest, append_output=append_output, folder_prefix=folder_prefix)
+        # Parsing blocks on the process pool, so keep it off the event loop
+        await asyncio.to_thread(parse_documents, str(input_dir), str(output_file), workspace_name, use_manifest=use_manifest, append_output=append_output, folder_prefix=folder_prefix)
 
         logger.info(f"Background: Document parsing completed for '{workspace_name}'. Output to {output_file}")
 
@@ -2339,7 +2363,7 @@ async def process_uploaded_documents_background(workspace_name: str, file_type:
                 # After embedding, generate AI prompts and return them
                 logger.info(f"Background: Generating AI prompts for '{workspace_name}' after embedding...")
                 from services.prompt_generator_service import generate_ai_prompts
-                prompts = generate_ai_prompts(workspace_name, base_dir=project_root)
+                prompts = await generate_ai_prompts(workspace_name, base_dir=project_root)
                 logger.info(f"Background: Generated {len(prompts) if prompts else 0} prompts for '{workspace_name}'.")
                 return prompts
         elif file_type == "criteria":
@@ -2563,7 +2587,7 @@ async def get_prepopulated_prompts(workspace_name: str):
             collection_info = qclient.get_collection(collection_name)
             if collection_info.points_count > 0:
                 logger.info(f"[/prompts] Qdrant collection '{collection_name}' exists with {collection_info.points_count} points. Generating AI prompts...")
-                ai_generated_general_prompts = generate_ai_prompts(workspace_name, base_dir=PROJECT_ROOT)
+                ai_generated_general_prompts = await generate_ai_prompts(workspace_name, base_dir=PROJECT_ROOT)
                 if ai_generated_general_prompts:
                     qa_prompts.extend(ai_generated_general_prompts[:10])
                     # Save the generated prompts to replace defaults
@@ -2593,7 +2617,8 @@ async def get_prepopulated_prompts(workspace_name: str):
 @app.post("/compare_responses")
 async def compare_ai_responses(request: CompareResponsesRequest):
     try:
-        comparison_result = compare_responses(request.openrouter_response, request.chatgpt_response)
+        # The judge LLM call is blocking; run it in a worker thread so the event loop keeps serving requests
+        comparison_result = await asyncio.to_thread(compare_responses, request.openrouter_response, request.chatgpt_response)
         return comparison_result
     except Exception as e:
         logger.error(f"Error comparing responses: {e}")
@@ -4570,6 +4595,16 @@ async def submit_contact_form(request: ContactFormRequest):
         logger.error(f"Error submitting contact form: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to submit contact form: {str(e)}")
 
+def run_on_main_loop(coro):
+    """
+    Run a coroutine on the server's event loop from the worker thread and wait for its result.
+    The shared async clients are bound to that loop, so there is no fallback to a fresh one.
+    """
+    if main_event_loop is None:
+        coro.close()
+        raise RuntimeError("Server event loop is not running; cannot run async job")
+    return asyncio.run_coroutine_threadsafe(coro, main_event_loop).result()
+
 def job_worker_loop():
     try:
         from services.rag_service import score_contracts
@@ -4641,8 +4676,9 @@ def job_worker_loop():
                                 logger.info(f"[Worker] Processing legal_analysis for workspace: {payload.get('workspace_name')}")
                                 
                                 from services.legal_service import perform_legal_analysis
-                                result = perform_legal_analysis(
-                                    workspace_name=payload.get('workspace_name')
+                                # Run on the server's event loop so the shared async clients stay on one loop
+                                result = run_on_main_loop(
+                                    perform_legal_analysis(workspace_name=payload.get('workspace_name'))
                                 )
                                 job_manager.update_job(job_id, "SUCCESS", result=result)
                                 logger.info(f"[Worker] ✅ Job {job_id} completed successfully")
@@ -4867,12 +4903,6 @@ def job_worker_loop():
     except Exception as e:
         logger.error(f"[Worker] Failed to start worker thread: {e}", exc_info=True)
 
-# Start worker thread when FastAPI launches
-logger.info("[Main] Starting Redis worker thread...")
-worker_thread = threading.Thread(target=job_worker_loop, daemon=True, name="RedisWorker")
-worker_thread.start()
-logger.info(f"[Main] Redis worker thread started with ID: {worker_thread.ident}")
-
 import uvicorn
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,86 @@
+# backend/services/embed_cache.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Persistent chunk-embedding cache so re-crawled pages skip the encoder. Rows are keyed by
+# (model, md5 of the text) so switching embedding models never returns stale vectors.
+EMBED_CACHE_PATH = Path(os.getenv("EMBED_CACHE_PATH", ".cache/embeds.sqlite3"))
+SQLITE_MAX_PARAMS = 500 # stays under SQLite's bound-parameter limit per IN (...) query
+
+def _text_md5(text: str) -> str:
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """SQLite key-value store of float32 embeddings, shared by all threads of the process."""
+
+    def __init__(self, path: Path = EMBED_CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so importing the module doesn't create the cache file
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, md5 TEXT, vec BLOB, PRIMARY KEY (model, md5))"
+            )
+        return self._conn
+
+    def get_or_encode_many(self, model_name: str, texts: list[str], encode) -> list:
+        """
+        Embeddings for texts, in order. Cache misses are encoded together with encode(list_of_texts)
+        and stored; a cache failure falls back to encoding everything.
+        """
+        keys = [_text_md5(text) for text in texts]
+        vectors = [None] * len(texts)
+        try:
+            with self._lock:
+                conn = self._connection()
+                found = {}
+                unique_keys = list(dict.fromkeys(keys))
+                for start in range(0, len(unique_keys), SQLITE_MAX_PARAMS):
+                    chunk = unique_keys[start:start + SQLITE_MAX_PARAMS]
+                    rows = conn.execute(
+                        f"SELECT md5, vec FROM embeddings WHERE model = ? AND md5 IN ({','.join('?' * len(chunk))})",
+                        [model_name, *chunk],
+                    )
+                    found.update(rows)
+            for i, key in enumerate(keys):
+                if key in found:
+                    vectors[i] = np.frombuffer(found[key], dtype=np.float32)
+        except sqlite3.Error as e:
+            logger.warning(f"[EmbedCache] Lookup failed: {e}")
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if not missing:
+            return vectors
+        encoded = encode([texts[i] for i in missing])
+        for i, vector in zip(missing, encoded):
+            vectors[i] = np.asarray(vector, dtype=np.float32)
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, md5, vec) VALUES (?, ?, ?)",
+                    [(model_name, keys[i], vectors[i].tobytes()) for i in missing],
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[EmbedCache] Store failed: {e}")
+        return vectors
+
+    def get_or_encode(self, model_name: str, text: str, encode):
+        """Single-text form of get_or_encode_many; encode is called with a one-element list."""
+        return self.get_or_encode_many(model_name, [text], encode)[0]
+
+embed_cache = EmbeddingCache()
@@ -2,14 +2,41 @@
 import os
 import json
 import logging
+import re
 import requests
 import time
 from typing import Dict, Any, List, Optional
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+# Review fields kept from the Places Details response, with their defaults
+_REVIEW_DEFAULTS = (
+    ('author_name', 'Anonymous'),
+    ('rating', 0),
+    ('text', ''),
+    ('time', 0),
+    ('relative_time_description', ''),
+    ('language', 'en'),
+)
+
+# Window for counting a review as recent (~6 months, in seconds)
+_RECENT_REVIEW_WINDOW = 6 * 30 * 24 * 60 * 60
+
+# Keyword patterns used to classify 3-star reviews
+_POSITIVE_KEYWORDS_RE = re.compile(
+    r'\b(good|great|excellent|amazing|love|recommend|helpful|professional)\b', re.IGNORECASE
+)
+_NEGATIVE_KEYWORDS_RE = re.compile(
+    r'\b(bad|terrible|awful|hate|disappointed|poor|unprofessional|waste)\b', re.IGNORECASE
+)
+
 class GooglePlacesService:
     """
     Service to fetch Google Places data including reviews and ratings for vendors.
@@ -19,6 +46,13 @@ class GooglePlacesService:
         self.api_key = os.getenv("GOOGLE_MAP_API")
         self.base_url = "https://maps.googleapis.com/maps/api/place"
         
+        # Reuse one keep-alive session for all Places calls and ask for compressed payloads
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept-Encoding': requests.utils.DEFAULT_ACCEPT_ENCODING,
+            'User-Agent': 'vendor-intel/1.0'
+        })
+        
         if not self.api_key:
             logger.warning("GOOGLE_MAP_API environment variable is not set. Google Places functionality will be disabled.")
     
@@ -85,10 +119,10 @@ class GooglePlacesService:
                 'type': 'establishment'
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
             
-            data = response.json()
+            data = self._parse_json(response)
             
             if data.get('status') != 'OK':
                 logger.warning(f"Google Places search failed: {data.get('status')} - {data.get('error_message', 'Unknown error')}")
@@ -118,6 +152,15 @@ class GooglePlacesService:
             logger.error(f"Error searching for place: {e}")
             return None
     
+    @staticmethod
+    def _parse_json(response: requests.Response) -> Dict[str, Any]:
+        """
+        Decode a JSON response body, using orjson when it is installed.
+        """
+        if orjson is not None:
+            return orjson.loads(response.content)
+        return response.json()
+    
     def _build_business_search_query(self, vendor_name: str, location: str = None) -> str:
         """
         Build a search query focused on business and technology companies.
@@ -213,10 +256,10 @@ class GooglePlacesService:
                 'fields': 'name,rating,user_ratings_total,formatted_address,formatted_phone_number,website,opening_hours,types,business_status'
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
             
-            data = response.json()
+            data = self._parse_json(response)
             
             if data.get('status') != 'OK':
                 logger.warning(f"Google Places details failed: {data.get('status')} - {data.get('error_message', 'Unknown error')}")
@@ -243,10 +286,10 @@ class GooglePlacesService:
                 'fields': 'reviews'
             }
             
-            response = requests.get(url, params=params, timeout=10)
+            response = self.session.get(url, params=params, timeout=10)
             response.raise_for_status()
             
-            data = response.json()
+            data = self._parse_json(response)
             
             if data.get('status') != 'OK':
                 logger.warning(f"Google Places reviews failed: {data.get('status')} - {data.get('error_message', 'Unknown error')}")
@@ -256,19 +299,10 @@ class GooglePlacesService:
             reviews = result.get('reviews', [])
             
             # Process reviews to extract relevant information
-            processed_reviews = []
-            for review in reviews:
-                processed_review = {
-                    'author_name': review.get('author_name', 'Anonymous'),
-                    'rating': review.get('rating', 0),
-                    'text': review.get('text', ''),
-                    'time': review.get('time', 0),
-                    'relative_time_description': review.get('relative_time_description', ''),
-                    'language': review.get('language', 'en')
-                }
-                processed_reviews.append(processed_review)
-            
-            return processed_reviews
+            return [
+                {key: review.get(key, default) for key, default in _REVIEW_DEFAULTS}
+                for review in reviews
+            ]
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Request error during reviews fetch: {e}")
@@ -333,23 +367,27 @@ class GooglePlacesService:
                 "recent_reviews_count": 0
             }
         
-        ratings = [review.get('rating', 0) for review in reviews if review.get('rating')]
-        
-        # Calculate rating distribution
-        rating_distribution = {}
-        for rating in range(1, 6):
-            rating_distribution[str(rating)] = ratings.count(rating)
-        
-        # Count recent reviews (within last 6 months)
-        current_time = time.time()
-        six_months_ago = current_time - (6 * 30 * 24 * 60 * 60)  # 6 months in seconds
-        recent_reviews = [r for r in reviews if r.get('time', 0) > six_months_ago]
+        # Single pass over reviews for ratings, distribution and recency
+        cutoff = time.time() - _RECENT_REVIEW_WINDOW
+        rating_counts = [0] * 6
+        rated_count = 0
+        ratings_sum = 0
+        recent_count = 0
+        for review in reviews:
+            rating = review.get('rating', 0)
+            if rating:
+                rated_count += 1
+                ratings_sum += rating
+                if rating in range(1, 6):
+                    rating_counts[int(rating)] += 1
+            if review.get('time', 0) > cutoff:
+                recent_count += 1
         
         return {
             "total_reviews": len(reviews),
-            "average_rating": sum(ratings) / len(ratings) if ratings else 0,
-            "rating_distribution": rating_distribution,
-            "recent_reviews_count": len(recent_reviews)
+            "average_rating": ratings_sum / rated_count if rated_count else 0,
+            "rating_distribution": {str(rating): rating_counts[rating] for rating in range(1, 6)},
+            "recent_reviews_count": recent_count
         }
     
     def _analyze_review_sentiment(self, reviews: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -371,7 +409,6 @@ class GooglePlacesService:
         
         for review in reviews:
             rating = review.get('rating', 0)
-            text = review.get('text', '').lower()
             
             # Simple sentiment analysis based on rating and keywords
             if rating >= 4:
@@ -379,12 +416,10 @@ class GooglePlacesService:
             elif rating <= 2:
                 negative_count += 1
             else:
-                # For 3-star reviews, check text for sentiment
-                positive_keywords = ['good', 'great', 'excellent', 'amazing', 'love', 'recommend', 'helpful', 'professional']
-                negative_keywords = ['bad', 'terrible', 'awful', 'hate', 'disappointed', 'poor', 'unprofessional', 'waste']
-                
-                positive_score = sum(1 for keyword in positive_keywords if keyword in text)
-                negative_score = sum(1 for keyword in negative_keywords if keyword in text)
+                # For 3-star reviews, check text for sentiment (distinct keywords matched)
+                text = review.get('text', '')
+                positive_score = len({m.lower() for m in _POSITIVE_KEYWORDS_RE.findall(text)})
+                negative_score = len({m.lower() for m in _NEGATIVE_KEYWORDS_RE.findall(text)})
                 
                 if positive_score > negative_score:
                     positive_count += 1
@@ -1,14 +1,25 @@
 # backend/services/legal_service.py
+import asyncio
 import json
 import logging
+import random
+import re
 import time
+from collections import defaultdict
+from operator import itemgetter
 from pathlib import Path
 from typing import Dict, List, Any, Optional
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.http import models
-from qdrant_client.http.models import Filter, FieldCondition, MatchValue
 import os
-import requests
+import httpx
+from services.llm_cache import get_cached, put_cached
+
+try:
+    import tiktoken
+    _TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken missing or its BPE file could not be fetched
+    _TOKEN_ENCODING = None
 
 logger = logging.getLogger(__name__)
 
@@ -17,10 +28,84 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 OPENROUTER_MODEL = "qwen/qwq-32b"
 
-def call_openrouter(prompt: str) -> tuple[str, float]:
+# Bump when the legal analysis prompt template changes so cached reports are not reused
+LEGAL_PROMPT_VERSION = "4"
+LLM_CACHE_NAMESPACE = f"{OPENROUTER_MODEL}:legal-v{LEGAL_PROMPT_VERSION}"
+LLM_SEMANTIC_CACHE = os.getenv("LLM_SEMANTIC_CACHE", "false").lower() == "true"
+
+# Token budgets for contract text sent to the model
+TOKEN_BUDGET_PER_CONTRACT = 2000
+LEGAL_PROMPT_TOKEN_BUDGET = 24000
+LEGAL_TERMS_RE = re.compile(
+    r"indemn|liabil|terminat|warrant|force majeure|\bSLAs?\b|penalt|\bIP\b|intellectual property|confidential",
+    re.IGNORECASE
+)
+
+# Qdrant configuration; gRPC avoids JSON framing on large scrolls but needs port 6334 reachable
+QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
+QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "false").lower() == "true"
+
+# Single shared async Qdrant client for the module; never construct one per call
+async_client = AsyncQdrantClient(
+    host=QDRANT_HOST,
+    port=QDRANT_PORT,
+    prefer_grpc=QDRANT_PREFER_GRPC,
+    timeout=60,
+)
+
+# Pooled HTTP/2 client for OpenRouter; keep-alive connections are reused across calls
+http_client = httpx.AsyncClient(
+    base_url=OPENROUTER_BASE_URL,
+    http2=True,
+    timeout=httpx.Timeout(120.0, connect=10.0),
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+)
+
+# Retry with random exponential backoff, plus a circuit breaker that fails fast during outages
+OPENROUTER_MAX_ATTEMPTS = 5
+OPENROUTER_MAX_BACKOFF = 30
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+_breaker = {"failures": 0, "open_until": 0.0}
+
+def _is_retryable(e: Exception) -> bool:
+    """Transport failures and throttling/5xx statuses; only these say the upstream is unhealthy."""
+    if isinstance(e, httpx.TransportError):
+        return True
+    return isinstance(e, httpx.HTTPStatusError) and e.response.status_code in RETRYABLE_STATUS_CODES
+
+async def _post_completion(headers: Dict[str, str], data: Dict[str, Any]) -> httpx.Response:
+    """POST a chat completion, retrying retryable failures with jittered exponential backoff."""
+    for attempt in range(OPENROUTER_MAX_ATTEMPTS):
+        try:
+            response = await http_client.post("/chat/completions", headers=headers, json=data)
+            response.raise_for_status()
+            return response
+        except (httpx.HTTPStatusError, httpx.TransportError) as e:
+            if not _is_retryable(e) or attempt == OPENROUTER_MAX_ATTEMPTS - 1:
+                raise
+            delay = random.uniform(0, min(2 ** attempt, OPENROUTER_MAX_BACKOFF))
+            logger.warning(f"OpenRouter call attempt {attempt + 1} failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def close_clients() -> None:
+    """Close the shared HTTP and Qdrant clients (called on application shutdown)."""
+    await http_client.aclose()
+    await async_client.close()
+
+async def call_openrouter(prompt: str, system_prompt: str = None, response_format: Optional[Dict[str, Any]] = None,
+                          cache_namespace: str = LLM_CACHE_NAMESPACE) -> tuple[str, float]:
     """Call OpenRouter API and return response and time taken."""
     start_time = time.time()
     
+    system_prompt = system_prompt or LEGAL_RUBRIC
+    cached = await get_cached(async_client, prompt, cache_namespace, semantic=LLM_SEMANTIC_CACHE,
+                              system_prompt=system_prompt, response_format=response_format)
+    if cached is not None:
+        return cached, time.time() - start_time
+    
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
@@ -31,6 +116,11 @@ def call_openrouter(prompt: str) -> tuple[str, float]:
     data = {
         "model": OPENROUTER_MODEL,
         "messages": [
+            {
+                "role": "system",
+                # Static rubric is marked as a prompt-caching breakpoint for providers that support it
+                "content": [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+            },
             {
                 "role": "user",
                 "content": prompt
@@ -39,55 +129,71 @@ def call_openrouter(prompt: str) -> tuple[str, float]:
         "temperature": 0.1,
         "max_tokens": 4000
     }
+    if response_format:
+        data["response_format"] = response_format
+    
+    if time.time() < _breaker["open_until"]:
+        logger.warning("OpenRouter circuit breaker is open; skipping API call")
+        return "Error: OpenRouter is temporarily unavailable, please retry shortly", time.time() - start_time
     
     try:
-        response = requests.post(
-            f"{OPENROUTER_BASE_URL}/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=120
-        )
-        response.raise_for_status()
+        try:
+            response = await _post_completion(headers, data)
+        except httpx.HTTPStatusError as e:
+            # Not every routed model supports structured outputs; fall back to free-form text once
+            if e.response.status_code != 400 or "response_format" not in data:
+                raise
+            logger.warning(f"OpenRouter rejected response_format for {OPENROUTER_MODEL}; retrying without it")
+            data.pop("response_format")
+            response_format = None
+            response = await _post_completion(headers, data)
+        # The upstream answered; malformed bodies and bad requests below don't count against it
+        _breaker["failures"] = 0
         
         result = response.json()
         content = result["choices"][0]["message"]["content"]
         
-        end_time = time.time()
-        return content, end_time - start_time
-        
     except Exception as e:
+        # Only outages and throttling trip the breaker; a bad prompt (4xx) must not block everyone else
+        if _is_retryable(e):
+            _breaker["failures"] += 1
+            if _breaker["failures"] >= BREAKER_FAILURE_THRESHOLD:
+                _breaker["open_until"] = time.time() + BREAKER_COOLDOWN
+                _breaker["failures"] = 0
+                logger.error(f"OpenRouter failed {BREAKER_FAILURE_THRESHOLD} calls in a row; opening circuit breaker for {BREAKER_COOLDOWN}s")
         logger.error(f"OpenRouter API call failed: {e}")
         return f"Error: {str(e)}", time.time() - start_time
+    
+    # Cache write failures are logged inside put_cached and never touch the breaker
+    await put_cached(async_client, prompt, content, cache_namespace, semantic=LLM_SEMANTIC_CACHE,
+                     system_prompt=system_prompt, response_format=response_format)
+    
+    end_time = time.time()
+    return content, end_time - start_time
 
-def get_all_contracts_from_collection(collection_name: str) -> Dict[str, str]:
+async def get_all_contracts_from_collection(collection_name: str) -> Dict[str, str]:
     """Retrieve all contracts from a Qdrant collection."""
     try:
-        QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
-        QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
-        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-        
-        # Get all documents from the collection
-        all_hits, _ = client.scroll(
-            collection_name=collection_name,
-            limit=10_000,
-        )
-        
-        # Group by source file
-        doc_names = list(set(hit.payload.get("source_file", "unknown") for hit in all_hits))
-        contract_texts = {}
-        
-        for name in doc_names:
-            hits, _ = client.scroll(
+        # Page through the whole collection once and group chunks by source file
+        chunks_by_file = defaultdict(list)
+        offset = None
+        while True:
+            hits, offset = await async_client.scroll(
                 collection_name=collection_name,
-                scroll_filter=Filter(
-                    must=[FieldCondition(key="source_file", match=MatchValue(value=name))]
-                ),
-                limit=10_000,
+                limit=1000,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
             )
-            hits.sort(key=lambda h: h.id)
-            full_text = "\n".join(h.payload["text"] for h in hits)
-            # Truncate to avoid API limits but keep more content for legal analysis
-            full_text = full_text[:12000]  # Increased limit for legal analysis
+            for hit in hits:
+                chunks_by_file[hit.payload.get("source_file", "unknown")].append((hit.id, hit.payload["text"]))
+            if offset is None:
+                break
+        
+        contract_texts = {}
+        for name, chunks in chunks_by_file.items():
+            chunks.sort(key=itemgetter(0))
+            full_text = "\n".join(text for _, text in chunks)
             contract_texts[name.replace(".pdf", "").replace("contracts/", "").strip()] = full_text
         
         logger.info(f"Retrieved {len(contract_texts)} contracts from collection {collection_name}")
@@ -97,18 +203,7 @@ def get_all_contracts_from_collection(collection_name: str) -> Dict[str, str]:
         logger.error(f"Error retrieving contracts from collection {collection_name}: {e}")
         return {}
 
-def create_legal_analysis_prompt(contract_texts: Dict[str, str], workspace_name: str) -> str:
-    """Create a comprehensive legal analysis prompt for contract clause recommendations."""
-    
-    contracts_summary = "\n\n".join([
-        f"=== CONTRACT: {name} ===\n{text[:8000]}..." if len(text) > 8000 else f"=== CONTRACT: {name} ===\n{text}"
-        for name, text in contract_texts.items()
-    ])
-    
-    prompt = f"""You are a legal expert specializing in contract law and procurement. Your task is to perform a comprehensive legal analysis of all contracts in the workspace "{workspace_name}" and provide clause recommendations based on the nature of procurement and services.
-
-CONTRACTS TO ANALYZE:
-{contracts_summary}
+LEGAL_RUBRIC = """You are a legal expert specializing in contract law and procurement. Your task is to perform a comprehensive legal analysis of the contracts provided by the user and provide clause recommendations based on the nature of procurement and services.
 
 Please provide a detailed legal analysis report covering the following areas:
 
@@ -163,28 +258,15 @@ Based on the procurement nature and service type, identify missing clauses:
 - Survival clauses
 
 ## 4. RISK-BASED CLAUSE RECOMMENDATIONS
-For each identified risk area, provide specific clause recommendations:
-
-### HIGH-RISK PROJECTS
-- Enhanced indemnity provisions
-- Stricter penalty structures
-- Comprehensive insurance requirements
-- Detailed force majeure definitions
-- Robust termination rights
-
-### MEDIUM-RISK PROJECTS
-- Standard indemnity and liability limits
-- Moderate penalty structures
-- Basic insurance requirements
-- Standard force majeure clauses
-- Balanced termination provisions
-
-### LOW-RISK PROJECTS
-- Basic liability protections
-- Minimal penalty structures
-- Standard insurance requirements
-- Simple force majeure clauses
-- Standard termination rights
+For each identified risk area, recommend clauses matching the project's risk tier:
+
+| Area | High risk | Medium risk | Low risk |
+|---|---|---|---|
+| Indemnity / liability | Enhanced indemnity | Standard indemnity and liability limits | Basic liability protections |
+| Penalties | Stricter structures | Moderate structures | Minimal structures |
+| Insurance | Comprehensive | Basic | Standard |
+| Force majeure | Detailed definitions | Standard clauses | Simple clauses |
+| Termination | Robust rights | Balanced provisions | Standard rights |
 
 ## 5. INDUSTRY-SPECIFIC RECOMMENDATIONS
 Based on the service type, recommend industry-specific clauses:
@@ -225,39 +307,194 @@ Provide a checklist of legal requirements to verify:
 
 Please provide a thorough, actionable legal analysis that focuses on practical clause recommendations tailored to the specific nature of the procurement and services in these contracts. Include specific clause language where appropriate and prioritize recommendations based on risk assessment.
 
-Format your response as a structured legal report with clear sections, specific recommendations, and actionable next steps."""
+Return a JSON object with one markdown-formatted field per section above, following the provided schema."""
 
-    return prompt
+# Report sections in rubric order: (JSON key, heading used when rendering markdown)
+LEGAL_REPORT_SECTIONS = [
+    ("contract_nature", "1. CONTRACT NATURE & PROCUREMENT TYPE ANALYSIS"),
+    ("existing_clauses", "2. EXISTING CLAUSE INVENTORY"),
+    ("missing_clauses", "3. MISSING CRITICAL CLAUSES ANALYSIS"),
+    ("risk_based_recommendations", "4. RISK-BASED CLAUSE RECOMMENDATIONS"),
+    ("industry_recommendations", "5. INDUSTRY-SPECIFIC RECOMMENDATIONS"),
+    ("clause_templates", "6. CLAUSE TEMPLATES & DRAFTING GUIDANCE"),
+    ("priority_matrix", "7. IMPLEMENTATION PRIORITY MATRIX"),
+    ("compliance_checklist", "8. COMPLIANCE CHECKLIST"),
+    ("summary_action_items", "9. SUMMARY & ACTION ITEMS"),
+]
 
-def perform_legal_analysis(workspace_name: str) -> Dict[str, Any]:
+LEGAL_REPORT_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "legal_analysis_report",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {key: {"type": "string"} for key, _ in LEGAL_REPORT_SECTIONS},
+            "required": [key for key, _ in LEGAL_REPORT_SECTIONS],
+            "additionalProperties": False
+        }
+    }
+}
+
+def count_tokens(text: str) -> int:
+    """Count tokens with cl100k_base, or estimate at ~4 characters per token without tiktoken."""
+    if _TOKEN_ENCODING is not None:
+        return len(_TOKEN_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+def select_contract_sections(text: str, budget: int = TOKEN_BUDGET_PER_CONTRACT) -> tuple[str, int]:
+    """
+    Fit a contract into a token budget, preferring legally relevant paragraphs.
+    Paragraphs are ranked by legal-term hits, packed greedily, then emitted in document order.
+    Returns the selected text and its token count.
+    """
+    total_tokens = count_tokens(text)
+    if total_tokens <= budget:
+        return text, total_tokens
+    
+    paragraphs = [p for p in text.split("\n\n") if p.strip()]
+    ranked = sorted(
+        range(len(paragraphs)),
+        key=lambda i: len(LEGAL_TERMS_RE.findall(paragraphs[i])),
+        reverse=True
+    )
+    
+    selected = []
+    used = 0
+    for i in ranked:
+        tokens = count_tokens(paragraphs[i])
+        if used + tokens > budget:
+            continue
+        selected.append(i)
+        used += tokens
+    
+    if not selected:
+        # A single oversized paragraph; fall back to a character cut of roughly the budget
+        snippet = text[:budget * 4] + "..."
+        return snippet, count_tokens(snippet)
+    
+    selected.sort()
+    return "\n\n".join(paragraphs[i] for i in selected) + "\n...", used
+
+def batch_contracts_by_budget(contract_tokens: Dict[str, int], budget: int = LEGAL_PROMPT_TOKEN_BUDGET) -> List[List[str]]:
+    """Group contract names so each group's token total stays within the prompt budget."""
+    batches = []
+    current = []
+    used = 0
+    for name, tokens in contract_tokens.items():
+        if current and used + tokens > budget:
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(name)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_legal_report(response: str) -> Optional[Dict[str, str]]:
+    """Parse a structured legal report; returns None if the model did not return the expected JSON."""
+    try:
+        sections = json.loads(response)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(sections, dict):
+        return None
+    # Strict schemas aren't enforced by every provider, so check the shape render_legal_report relies on
+    if not all(isinstance(sections.get(key), str) for key, _ in LEGAL_REPORT_SECTIONS):
+        return None
+    return sections
+
+def render_legal_report(sections: Dict[str, str]) -> str:
+    """Render structured report sections as the markdown report the UI displays and edits."""
+    return "\n\n".join(
+        f"## {heading}\n{sections[key]}".rstrip()
+        for key, heading in LEGAL_REPORT_SECTIONS
+        if sections.get(key)
+    )
+
+def create_legal_analysis_prompt(contract_texts: Dict[str, str], workspace_name: str) -> str:
+    """
+    Create the per-workspace legal analysis prompt; the fixed rubric is sent separately as LEGAL_RUBRIC.
+    Contract texts are expected to be trimmed with select_contract_sections.
+    """
+    
+    # Build every piece into one list and join once, so contract text is copied a single time
+    parts = [f'Analyze all contracts in the workspace "{workspace_name}".', "CONTRACTS TO ANALYZE:"]
+    for name, text in contract_texts.items():
+        parts.append(f"=== CONTRACT: {name} ===\n{text}")
+    
+    return "\n\n".join(parts)
+
+# In-flight analyses by workspace, so concurrent requests for the same workspace share one run
+_inflight_analyses: Dict[str, asyncio.Task] = {}
+
+async def perform_legal_analysis(workspace_name: str) -> Dict[str, Any]:
     """Perform comprehensive legal analysis for contract clause recommendations."""
+    # No await between lookup and insert, so this check-and-set is atomic on the event loop
+    task = _inflight_analyses.get(workspace_name)
+    if task is None:
+        task = asyncio.create_task(_run_legal_analysis(workspace_name))
+        _inflight_analyses[workspace_name] = task
+        task.add_done_callback(lambda t: _inflight_analyses.pop(workspace_name, None) if _inflight_analyses.get(workspace_name) is t else None)
+    else:
+        logger.info(f"Joining in-flight legal analysis for workspace: {workspace_name}")
+    
+    # Shield so one caller disconnecting does not cancel the run for the others
+    result = await asyncio.shield(task)
+    return dict(result)
+
+async def _run_legal_analysis(workspace_name: str) -> Dict[str, Any]:
     logger.info(f"Starting legal analysis for workspace: {workspace_name}")
     
     collection_name = f"contract_docs_{workspace_name}"
+    # Scope cached reports to the workspace so identical prompts never leak across tenants
+    cache_namespace = f"{LLM_CACHE_NAMESPACE}:{collection_name}"
     
     try:
         # Check if collection exists
-        QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
-        QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
-        client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-        
-        if not client.collection_exists(collection_name):
+        if not await async_client.collection_exists(collection_name):
             raise Exception(f"No contracts found for workspace '{workspace_name}'. Please upload and embed contracts first.")
         
         # Get all contracts
-        contract_texts = get_all_contracts_from_collection(collection_name)
+        contract_texts = await get_all_contracts_from_collection(collection_name)
         
         if not contract_texts:
             raise Exception(f"No contract documents found in collection '{collection_name}'")
         
-        # Create legal analysis prompt
-        legal_prompt = create_legal_analysis_prompt(contract_texts, workspace_name)
+        # Fit each contract into its token budget, then split into as many prompts as the global budget needs
+        selected_texts = {}
+        contract_tokens = {}
+        for name, text in contract_texts.items():
+            selected_texts[name], contract_tokens[name] = select_contract_sections(text)
+        batches = batch_contracts_by_budget(contract_tokens)
+        
+        legal_prompts = [
+            create_legal_analysis_prompt({name: selected_texts[name] for name in batch}, workspace_name)
+            for batch in batches
+        ]
         
-        logger.info(f"Legal analysis prompt created with {len(legal_prompt)} characters")
+        logger.info(f"Legal analysis prompts created: {len(legal_prompts)} prompt(s), {sum(map(len, legal_prompts))} characters, {sum(contract_tokens.values())} contract tokens")
         
         # Call OpenRouter for legal analysis
         start_time = time.time()
-        legal_response, api_time = call_openrouter(legal_prompt)
+        responses = await asyncio.gather(*(
+            call_openrouter(prompt, response_format=LEGAL_REPORT_FORMAT, cache_namespace=cache_namespace)
+            for prompt in legal_prompts
+        ))
+        api_time = max(elapsed for _, elapsed in responses)
+        
+        # Keep the structured sections and render the markdown report from them
+        legal_sections = []
+        report_parts = []
+        for batch, (response, _) in zip(batches, responses):
+            sections = parse_legal_report(response)
+            if sections is None:
+                logger.warning(f"Legal analysis response for {batch} was not structured JSON; keeping raw text")
+            legal_sections.append({"contracts": batch, "sections": sections})
+            report = render_legal_report(sections) if sections else response
+            report_parts.append(report if len(batches) == 1 else f"# Contracts: {', '.join(batch)}\n\n{report}")
+        legal_response = "\n\n".join(report_parts)
         total_time = time.time() - start_time
         
         # Prepare results
@@ -267,6 +504,7 @@ def perform_legal_analysis(workspace_name: str) -> Dict[str, Any]:
             "contracts_analyzed": len(contract_texts),
             "contract_names": list(contract_texts.keys()),
             "legal_analysis_report": legal_response,
+            "legal_analysis_sections": legal_sections,
             "processing_time": {
                 "total_time": round(total_time, 2),
                 "api_time": round(api_time, 2),
@@ -0,0 +1,138 @@
+# backend/services/llm_cache.py
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from typing import Optional
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, Range
+
+logger = logging.getLogger(__name__)
+
+# LLM responses are stored as points in this collection: the payload holds the
+# response and the vector is an embedding of the prompt prefix, so semantic
+# lookups reuse Qdrant's ANN index.
+CACHE_COLLECTION = "llm_cache"
+DEFAULT_TTL = 7 * 24 * 3600
+SEMANTIC_THRESHOLD = 0.92
+EMBED_PREFIX_CHARS = 2000
+
+# Embedding dimension of the cache collection, set once it is known to exist
+_vector_size: Optional[int] = None
+
+def _variant(system_prompt: Optional[str], response_format: Optional[dict]) -> str:
+    """Digest of the request settings besides the prompt that change the response."""
+    settings = json.dumps([system_prompt, response_format], sort_keys=True)
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()[:32]
+
+def prompt_key(prompt: str, namespace: str, system_prompt: Optional[str] = None, response_format: Optional[dict] = None) -> str:
+    """Exact-match cache key for a prompt within a namespace (model + prompt version), system prompt and response format."""
+    variant = _variant(system_prompt, response_format)
+    return hashlib.sha256(f"{namespace}\n{variant}\n{prompt}".encode("utf-8")).hexdigest()
+
+def _point_id(key: str) -> str:
+    # Qdrant point IDs must be unsigned ints or UUIDs
+    return str(uuid.UUID(key[:32]))
+
+def _embed(prompt: str) -> list[float]:
+    # Reuse the embedding model already loaded by the RAG service
+    from services.rag_service import model
+    return model.encode(prompt[:EMBED_PREFIX_CHARS], normalize_embeddings=True).tolist()
+
+def _embedding_dimension() -> int:
+    from services.rag_service import model
+    return model.get_sentence_embedding_dimension()
+
+async def _ensure_collection(client: AsyncQdrantClient) -> int:
+    """Create the cache collection if needed and return its vector size."""
+    global _vector_size
+    if _vector_size is not None:
+        return _vector_size
+    # The first import of rag_service loads the embedding model; keep that off the event loop
+    size = await asyncio.to_thread(_embedding_dimension)
+    if not await client.collection_exists(CACHE_COLLECTION):
+        logger.info(f"[LLMCache] Creating collection {CACHE_COLLECTION}")
+        await client.create_collection(
+            collection_name=CACHE_COLLECTION,
+            vectors_config=VectorParams(size=size, distance=Distance.DOT)
+        )
+    _vector_size = size
+    return size
+
+async def get_cached(client: AsyncQdrantClient, prompt: str, namespace: str, semantic: bool = False,
+                     system_prompt: Optional[str] = None, response_format: Optional[dict] = None) -> Optional[str]:
+    """Return a cached response for the prompt, or None on a miss.
+
+    Looks up the exact prompt hash first; when `semantic` is set, falls back to
+    the nearest cached prompt in the same namespace above SEMANTIC_THRESHOLD.
+    Only responses stored with the same system prompt and response format match.
+    """
+    try:
+        await _ensure_collection(client)
+        now = time.time()
+
+        points = await client.retrieve(
+            collection_name=CACHE_COLLECTION,
+            ids=[_point_id(prompt_key(prompt, namespace, system_prompt, response_format))],
+            with_payload=True,
+        )
+        if points and points[0].payload.get("expires_at", 0) > now:
+            logger.info(f"[LLMCache] Exact hit in namespace '{namespace}'")
+            return points[0].payload["response"]
+
+        if not semantic:
+            return None
+
+        vector = await asyncio.to_thread(_embed, prompt)
+        hits = await client.search(
+            collection_name=CACHE_COLLECTION,
+            query_vector=vector,
+            query_filter=Filter(must=[
+                FieldCondition(key="namespace", match=MatchValue(value=namespace)),
+                FieldCondition(key="variant", match=MatchValue(value=_variant(system_prompt, response_format))),
+                FieldCondition(key="expires_at", range=Range(gt=now)),
+            ]),
+            limit=1,
+            score_threshold=SEMANTIC_THRESHOLD,
+            with_payload=True,
+        )
+        if hits:
+            logger.info(f"[LLMCache] Semantic hit in namespace '{namespace}' (score {hits[0].score:.3f})")
+            return hits[0].payload["response"]
+        return None
+
+    except Exception as e:
+        logger.warning(f"[LLMCache] Lookup failed: {e}")
+        return None
+
+async def put_cached(client: AsyncQdrantClient, prompt: str, response: str, namespace: str, ttl: int = DEFAULT_TTL,
+                     semantic: bool = False, system_prompt: Optional[str] = None, response_format: Optional[dict] = None) -> None:
+    """Store a response for the prompt; failures are logged and ignored.
+
+    The prompt is only embedded when `semantic` is set; otherwise the point gets
+    a zero vector, which scores 0 and never clears SEMANTIC_THRESHOLD.
+    """
+    try:
+        size = await _ensure_collection(client)
+        key = prompt_key(prompt, namespace, system_prompt, response_format)
+        vector = await asyncio.to_thread(_embed, prompt) if semantic else [0.0] * size
+        created_at = time.time()
+        await client.upsert(
+            collection_name=CACHE_COLLECTION,
+            points=[PointStruct(
+                id=_point_id(key),
+                vector=vector,
+                payload={
+                    "key": key,
+                    "namespace": namespace,
+                    "variant": _variant(system_prompt, response_format),
+                    "response": response,
+                    "created_at": created_at,
+                    "expires_at": created_at + ttl,
+                }
+            )]
+        )
+    except Exception as e:
+        logger.warning(f"[LLMCache] Store failed: {e}")
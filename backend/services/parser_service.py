@@ -1,8 +1,14 @@
 from pathlib import Path
+import csv
+import io
 import json
 import os
 import logging
+import multiprocessing
 import hashlib # Make sure hashlib is imported for compute_md5
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import List, Optional
 from PyPDF2 import PdfReader # Make sure PyPDF2 is imported
 # from allyin.multimodal2text import extract_text # Assuming this is available and correctly installed for docx/xlsx
 
@@ -21,18 +27,39 @@ except ImportError:
         raise NotImplementedError("DOCX/XLSX parsing not available without allyin.multimodal2text")
 
 
-logging.basicConfig(level=logging.INFO)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fitz  # PyMuPDF: C-backed PDF text extraction, much faster than PyPDF2
+except ImportError:
+    fitz = None
+
+try:
+    import openpyxl  # Streams .xlsx rows for _extract_text_from_xlsx
+except ImportError:
+    openpyxl = None
+
+
 logger = logging.getLogger(__name__)
 
+# Content-addressed cache of parse output, keyed by file hash and extractor, shared across workspaces
+PARSE_CACHE_DIR = Path(__file__).resolve().parent.parent.parent / "data" / ".parse_cache"
+PARSE_CACHE_VERSION = 1 # Bump when _parse_file's output changes so old entries are ignored
+
+def _json_bytes(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf-8")
+
 # Helper to compute md5 hash of a file (Ensure this is correctly defined)
+# file_digest streams the file through OpenSSL in C with a large buffer (Python 3.11+)
 def compute_md5(file_path):
-    hash_md5 = hashlib.md5()
     with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-import pandas as pd
+        return hashlib.file_digest(f, "md5").hexdigest()
 
 def _extract_text_from_xlsx(filepath: str) -> str:
     """
@@ -44,15 +71,22 @@ def _extract_text_from_xlsx(filepath: str) -> str:
         ext = os.path.splitext(filepath)[-1].lower()
 
         if ext == ".csv":
-            df = pd.read_csv(filepath)
-            text_output.append(f"Sheet: CSV")
-            text_output.append(df.to_csv(index=False))
+            # Already CSV; pass the bytes through without building a DataFrame
+            with open(filepath, "rb") as src:
+                text_output.append(f"Sheet: CSV")
+                text_output.append(src.read().decode("utf-8", "replace"))
         else:
-            xl = pd.ExcelFile(filepath)
-            for sheet_name in xl.sheet_names:
-                df = xl.parse(sheet_name)
-                text_output.append(f"Sheet: {sheet_name}")
-                text_output.append(df.to_csv(index=False))
+            # read_only streams rows instead of loading the whole workbook
+            workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+            try:
+                for sheet in workbook.worksheets:
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer, lineterminator="\n")
+                    writer.writerows(sheet.iter_rows(values_only=True))  # None cells become empty fields
+                    text_output.append(f"Sheet: {sheet.title}")
+                    text_output.append(buffer.getvalue())
+            finally:
+                workbook.close()
 
         return "\n\n".join(text_output)
 
@@ -62,6 +96,174 @@ def _extract_text_from_xlsx(filepath: str) -> str:
     
 
 
+def _parse_cache_key(file_hash: str, filename: str) -> str:
+    """
+    Cache key for a file's parse output: its content hash plus the extractor _parse_file would use,
+    so output from one backend (e.g. PyPDF2) isn't reused once another (PyMuPDF) is installed.
+    """
+    suffix = Path(filename).suffix.lower()
+    if suffix == ".pdf":
+        extractor = "pymupdf" if fitz is not None else "pypdf2"
+    elif suffix == ".xlsx" and openpyxl is not None:
+        extractor = "openpyxl"
+    elif suffix in [".docx", ".xlsx"]:
+        extractor = "multimodal2text"
+    else:
+        extractor = "text"
+    return f"{file_hash}-{extractor}-v{PARSE_CACHE_VERSION}"
+
+
+def _read_parse_cache(cache_key: str, file_label: str, source_type: str) -> Optional[List[dict]]:
+    """
+    Returns cached records for a cache key with the "file" and "source_type" fields set for the
+    current file name, or None on a miss.
+    """
+    cache_file = PARSE_CACHE_DIR / f"{cache_key}.jsonl"
+    if not cache_file.exists():
+        return None
+    try:
+        with open(cache_file, "rb") as f:
+            docs = [orjson.loads(line) if orjson is not None else json.loads(line) for line in f if line.strip()]
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable parse cache entry {cache_file}: {e}")
+        return None
+    for doc in docs:
+        doc["file"] = file_label
+        doc["source_type"] = source_type
+    return docs
+
+
+def _write_parse_cache(cache_key: str, docs: List[dict]) -> None:
+    try:
+        PARSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_file = PARSE_CACHE_DIR / f"{cache_key}.jsonl"
+        tmp_file = cache_file.with_suffix(".tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(b"".join(_json_bytes(doc) + b"\n" for doc in docs))
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        logger.warning(f"Could not write parse cache entry for {cache_key}: {e}")
+
+
+def _extract_pdf_pages(filepath: str) -> List[str]:
+    """
+    Returns the text of each PDF page, using PyMuPDF when installed and PyPDF2 otherwise.
+    """
+    if fitz is not None:
+        with fitz.open(filepath) as doc:
+            return [page.get_text("text") or "" for page in doc]
+    reader = PdfReader(filepath)
+    return [page.extract_text() or "" for page in reader.pages]
+
+
+def _parse_file(filepath: str, filename: str, folder_prefix: str = "") -> Optional[List[dict]]:
+    """
+    Parses a single file into page-level records.
+    Kept at module level so it can run in a ProcessPoolExecutor worker.
+
+    Returns:
+        list[dict] | None: Parsed records, or None if the file could not be parsed.
+    """
+    file_label = f"{folder_prefix}/{filename}" if folder_prefix else filename # Include folder prefix if provided
+    docs = []
+
+    # Use appropriate parsing logic based on file extension
+    suffix = Path(filename).suffix.lower()
+    
+    if suffix == ".pdf":
+        try:
+            for page_num, page_text in enumerate(_extract_pdf_pages(filepath)):
+                docs.append({
+                    "file": file_label,
+                    "page": page_num + 1,
+                    "text": page_text,
+                    "source_type": "pdf"
+                })
+        except Exception as e:
+            logger.error(f"Error parsing PDF file {filename}: {e}. Skipping file.")
+            return None # Skip this file if parsing fails
+    
+    elif suffix == ".xlsx" and openpyxl is not None:
+        text_content = _extract_text_from_xlsx(filepath)
+        if not text_content:
+            logger.error(f"Error parsing {suffix} file {filename}. Skipping file.")
+            return None
+        docs.append({
+            "file": file_label,
+            "page": 1,
+            "text": text_content,
+            "source_type": "xlsx"
+        })
+
+    elif suffix in [".docx", ".xlsx"]:
+        try:
+            # Ensure allyin.multimodal2text is installed and works
+            text_content = extract_text(str(filepath))
+            docs.append({
+                "file": file_label,
+                "page": 1, # Assumes these files are single logical documents for page tracking
+                "text": text_content,
+                "source_type": suffix.lstrip(".")
+            })
+        except NotImplementedError:
+            logger.error(f"DOCX/XLSX parsing not implemented or library missing for {filename}. Skipping file.")
+            return None
+        except Exception as e:
+            logger.error(f"Error parsing {suffix} file {filename}: {e}. Skipping file.")
+            return None
+
+    else:
+        # For unknown or simple text files, try common encodings
+        # If you expect very specific text files (e.g., criteria.txt), adjust encoding.
+        # For generic, safer to assume binary then try decoding.
+        logger.warning(f"Attempting to read unrecognized file type: {filename}. Trying common text encodings.")
+        try:
+            with open(filepath, 'r', encoding='utf-8') as infile:
+                content = infile.read()
+        except UnicodeDecodeError:
+            try:
+                with open(filepath, 'r', encoding='latin-1') as infile:
+                    content = infile.read()
+            except Exception as e:
+                logger.error(f"Could not decode text file {filename} with UTF-8 or Latin-1: {e}. Skipping file.")
+                return None
+        except Exception as e:
+            logger.error(f"Error reading generic file {filename}: {e}. Skipping file.")
+            return None
+
+        docs.append({
+            "file": file_label,
+            "page": 1,
+            "text": content,
+            "source_type": suffix.lstrip(".") or "txt" # Default to 'txt' if no suffix
+        })
+
+    return docs
+
+
+def _index_path(output_file) -> Path:
+    """Sidecar offset index for a JSONL output file (parsed.jsonl -> parsed.idx)."""
+    return Path(output_file).with_suffix(".idx")
+
+
+def _rebuild_offset_index(output_file) -> None:
+    """Writes the offset index for an existing JSONL file from a single scan."""
+    entries = []
+    offset = 0
+    with open(output_file, "rb") as f:
+        for line in f:
+            stripped = line.rstrip(b"\n")
+            if stripped.strip():
+                try:
+                    doc = json.loads(stripped)
+                    entries.append({"file": doc.get("file"), "page": doc.get("page", 1), "offset": offset, "length": len(stripped)})
+                except json.JSONDecodeError:
+                    pass
+            offset += len(line)
+    with open(_index_path(output_file), "wb") as index_file:
+        index_file.write(b"".join(_json_bytes(entry) + b"\n" for entry in entries))
+
+
 def parse_documents(input_dir: str, output_file: str, workspace: str, use_manifest: bool = True, append_output: bool = True, folder_prefix: str = ""):
     """
     Parses documents from the input directory and writes the parsed output to a JSONL file.
@@ -98,10 +300,14 @@ def parse_documents(input_dir: str, output_file: str, workspace: str, use_manife
     
     try:
         # Get list of files to parse
-        files_to_parse = [f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f))]
+        # scandir's DirEntry carries the file type and full path, avoiding a stat and join per entry
+        with os.scandir(input_dir) as entries:
+            files_to_parse = [(entry.name, entry.path) for entry in entries if entry.is_file()]
         
-        for filename in files_to_parse:
-            filepath = os.path.join(input_dir, filename)
+        # Hash files up front and keep only new or modified ones
+        work_list = []
+        cached_results = {}
+        for filename, filepath in files_to_parse:
             file_hash = compute_md5(filepath)
             
             # Check if the file is new or has been modified since the last parse
@@ -109,84 +315,82 @@ def parse_documents(input_dir: str, output_file: str, workspace: str, use_manife
                 logger.info(f"⏩ Skipping unchanged file: {filename}")
                 continue
             
-            # Use appropriate parsing logic based on file extension
-            suffix = Path(filename).suffix.lower()
-            
-            if suffix == ".pdf":
-                try:
-                    reader = PdfReader(filepath)
-                    for page_num, page in enumerate(reader.pages):
-                        page_text = page.extract_text() or ""
-                        output_docs.append({
-                            "file": f"{folder_prefix}/{filename}" if folder_prefix else filename, # Include folder prefix if provided
-                            "page": page_num + 1,
-                            "text": page_text,
-                            "source_type": "pdf"
-                        })
-                except Exception as e:
-                    logger.error(f"Error parsing PDF file {filename}: {e}. Skipping file.")
-                    continue # Skip to the next file if parsing fails
-            
-            elif suffix in [".docx", ".xlsx"]:
-                try:
-                    # Ensure allyin.multimodal2text is installed and works
-                    text_content = extract_text(str(filepath))
-                    output_docs.append({
-                        "file": f"{folder_prefix}/{filename}" if folder_prefix else filename, # Include folder prefix if provided
-                        "page": 1, # Assumes these files are single logical documents for page tracking
-                        "text": text_content,
-                        "source_type": suffix.lstrip(".")
-                    })
-                except NotImplementedError:
-                    logger.error(f"DOCX/XLSX parsing not implemented or library missing for {filename}. Skipping file.")
-                    continue
-                except Exception as e:
-                    logger.error(f"Error parsing {suffix} file {filename}: {e}. Skipping file.")
-                    continue
-
-            else:
-                # For unknown or simple text files, try common encodings
-                # If you expect very specific text files (e.g., criteria.txt), adjust encoding.
-                # For generic, safer to assume binary then try decoding.
-                logger.warning(f"Attempting to read unrecognized file type: {filename}. Trying common text encodings.")
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as infile:
-                        content = infile.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(filepath, 'r', encoding='latin-1') as infile:
-                            content = infile.read()
-                    except Exception as e:
-                        logger.error(f"Could not decode text file {filename} with UTF-8 or Latin-1: {e}. Skipping file.")
-                        continue
-                except Exception as e:
-                    logger.error(f"Error reading generic file {filename}: {e}. Skipping file.")
-                    continue
-
-                output_docs.append({
-                    "file": f"{folder_prefix}/{filename}" if folder_prefix else filename, # Include folder prefix if provided
-                    "page": 1,
-                    "text": content,
-                    "source_type": suffix.lstrip(".") or "txt" # Default to 'txt' if no suffix
-                })
+            # Identical content parsed before (renamed, copied or in another workspace)
+            cached_docs = _read_parse_cache(
+                _parse_cache_key(file_hash, filename),
+                f"{folder_prefix}/{filename}" if folder_prefix else filename,
+                Path(filename).suffix.lower().lstrip(".") or "txt"  # Same source_type _parse_file assigns
+            )
+            if cached_docs is not None:
+                logger.info(f"♻️ Reusing cached parse output for: {filename}")
+                cached_results[filename] = (file_hash, cached_docs)
+                continue
+            work_list.append((filepath, filename, file_hash))
+        
+        # Parsing is CPU-bound (PDF and Office text extraction), so fan files out across processes
+        if len(work_list) > 1:
+            max_workers = min(len(work_list), os.cpu_count() or 1)
+            # spawn, not fork: the server process has live threads (model, HTTP clients) whose locks a fork could copy held
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                results = list(executor.map(
+                    _parse_file,
+                    [filepath for filepath, _, _ in work_list],
+                    [filename for _, filename, _ in work_list],
+                    repeat(folder_prefix)
+                ))
+        else:
+            results = [_parse_file(filepath, filename, folder_prefix) for filepath, filename, _ in work_list]
+        
+        parsed_results = {}
+        for (filepath, filename, file_hash), docs in zip(work_list, results):
+            if docs is not None:
+                _write_parse_cache(_parse_cache_key(file_hash, filename), docs)
+                parsed_results[filename] = (file_hash, docs)
+        
+        # Emit in directory order regardless of whether the file came from the cache
+        for filename, _ in files_to_parse:
+            result = cached_results.get(filename) or parsed_results.get(filename)
+            if result is None:
+                continue
+            file_hash, docs = result
+            output_docs.extend(docs)
             
             # If successfully processed, update the manifest with the new hash
             if use_manifest:
                 updated_manifest[filename] = file_hash
 
         # Append new documents to the output file (using append mode 'a' or write mode 'w')
-        mode = 'a' if append_output else 'w'
-        with open(output_file, mode, encoding='utf-8') as outfile:
-            for doc in output_docs:
-                json_line = json.dumps(doc)
-                outfile.write(json_line + "\n")
+        mode = 'ab' if append_output else 'wb'
+        index_path = _index_path(output_file)
+        if not os.path.exists(output_file):
+            index_mode = 'wb'  # Any index left behind describes a deleted output file; start it over
+        else:
+            index_mode = mode
+            if append_output and not index_path.exists():
+                _rebuild_offset_index(output_file)  # Output predates the index; cover existing records once
+        index_entries = []
+        with open(output_file, mode) as outfile:
+            if output_docs:
+                # Record where each line lands so readers can seek instead of rescanning the file
+                offset = outfile.tell()
+                lines = []
+                for doc in output_docs:
+                    line = _json_bytes(doc)
+                    lines.append(line)
+                    index_entries.append({"file": doc["file"], "page": doc.get("page", 1), "offset": offset, "length": len(line)})
+                    offset += len(line) + 1
+                # One buffered write for the whole batch instead of one per document
+                outfile.write(b"\n".join(lines) + b"\n")
+        with open(index_path, index_mode) as index_file:
+            if index_entries:
+                index_file.write(b"".join(_json_bytes(entry) + b"\n" for entry in index_entries))
         
         # Save the updated manifest
         if use_manifest:
             # Ensure the manifest directory exists
             Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
-            with open(manifest_path, "w", encoding="utf-8") as f:
-                json.dump(updated_manifest, f, indent=2)
+            with open(manifest_path, "wb") as f:
+                f.write(_json_bytes(updated_manifest, indent=True))
             
         logger.info(f"Completed parsing documents for workspace '{workspace}'. Added {len(output_docs)} new entries. Output saved to '{output_file}'.")
     
@@ -1,45 +1,305 @@
 # backend/services/prompt_generator_service.py
 import os
+import asyncio
+import contextlib
+import functools
+import heapq
 import json
+import mmap
 import re
+from collections import Counter
 from pathlib import Path
+import numpy as np
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-from qdrant_client.models import Filter, FieldCondition, MatchValue
-from sentence_transformers import SentenceTransformer
-from typing import List
+from typing import List, Tuple
 import logging # Import logging
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 logger = logging.getLogger(__name__) # Get logger for this module
 
 # Import necessary functions from other services
-from services.rag_service import call_openrouter, call_chatgpt
+from services.rag_service import stream_openrouter_async, call_chatgpt
 from services.helper_service import extract_criteria_from_jsonl
 
 # Load env variables for this service
 load_dotenv()
 # Note: OPENROUTER_API_KEY and OPENAI_API_KEY are used by call_openrouter/call_chatgpt,
 # which are imported here.
-QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
-QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
-# --- Initialize client and model for this service ---
-# These are initialized here as the service directly depends on them.
-client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-# text_encoder_model = SentenceTransformer("all-MiniLM-L6-v2") # Not strictly needed for embedding here, but for model initialization if it was only here
+# Prompt generation reads parsed.jsonl directly, so this service needs no Qdrant client.
 
 # --- Define a SMALLER LLM for prompt generation ---
 # Changed to a faster, smaller model for prompt generation to improve responsiveness
 # This model is specifically for generating prompts, not for RAG answers/scoring.
 SMALL_PROMPT_GEN_MODEL = "mistralai/mistral-7b-instruct:free" # Changed from "mistralai/mistral-small-3.2-24b-instruct:free"
 
-def generate_ai_prompts(workspace_name: str, base_dir: Path) -> List[str]:
+# Frequent bigram/trigram mining adds mostly generic phrases on top of the curated list; off by default
+PROMPT_GEN_NGRAM_KEYWORDS = os.getenv("PROMPT_GEN_NGRAM_KEYWORDS", "false").lower() == "true"
+NGRAM_MIN_COUNT = 5 # An n-gram must occur more often than this to count as a keyword
+
+# Fixed parts of the prompt-generation prompt; the context section is assembled between them
+LLM_PROMPT_HEADER = """
+You are an expert in contract analysis and business intelligence.
+Your task is to generate 10 diverse, very simple, short and highly relevant prompts (questions)
+that a user might ask about contracts, the answers to these questions should be easily extractable.
+These prompts should be actionable and cover information extraction, comparison, or evaluation aspects.
+Focus on common contract elements, key entities, and any specific criteria provided.
+Ensure the questions are direct and can be answered from a contract document.
+
+### Context for Prompt Generation:
+"""
+LLM_PROMPT_FOOTER = """
+Generate exactly 10 prompts.
+Prioritize clarity, simplicity, relevance, and actionability.
+Your output must be a JSON array of strings, like this:
+{
+  "prompts": [
+    "Prompt 1: ...",
+    "Prompt 2: ...",
+    "Prompt 3: ...",
+    "..."
+  ]
+}
+"""
+
+# Number of prompts requested from the LLM; the stream is cut once this many have been decoded
+PROMPT_GEN_COUNT = 10
+
+# Ask OpenRouter for JSON mode so the reply needs no fence stripping
+PROMPT_GEN_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Per-contract character budget for prompt context (avoids exceeding the model's context window)
+CONTRACT_TEXT_CHAR_LIMIT = 8000
+
+def _json_loads(data):
+    """Parse JSON from str or bytes, using orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+# --- Precompiled patterns for context extraction ---
+COMPANY_DESIGNATORS = r'\b(?:LLC|Inc|Corp|Limited|Ltd|Company|Co|Corporation|Group|Holdings|Solutions|Technologies|Services|Associates|Partners|Ventures|Systems|Global|International|Digital|Pte?\.? Ltd|GmbH|AG|SA|AB|NV|BV|PLC|S\.A\.S)\b'
+COMPANY_REGEX = r'([A-Z][a-zA-Z0-9\s,\.&-]{1,50}?' + COMPANY_DESIGNATORS + r')' # Captures actual name + designator
+COMPANY_PATTERN = re.compile(COMPANY_REGEX, re.IGNORECASE)
+TRAILING_PUNCT_PATTERN = re.compile(r'[,\.]+$')
+
+# Literal forms of COMPANY_DESIGNATORS for the Aho-Corasick scan (lowercase)
+DESIGNATOR_LITERALS = [
+    "llc", "inc", "corp", "limited", "ltd", "company", "co", "corporation", "group",
+    "holdings", "solutions", "technologies", "services", "associates", "partners",
+    "ventures", "systems", "global", "international", "digital",
+    "pte ltd", "pte. ltd", "pt ltd", "pt. ltd", "gmbh", "ag", "sa", "ab", "nv", "bv", "plc", "s.a.s"
+]
+# Name part preceding a designator hit, anchored at the designator start
+COMPANY_PREFIX_PATTERN = re.compile(r'[A-Z][a-zA-Z0-9\s,\.&-]{1,50}$', re.IGNORECASE)
+
+def _build_designator_automaton():
+    automaton = ahocorasick.Automaton()
+    for designator in DESIGNATOR_LITERALS:
+        automaton.add_word(designator, len(designator))
+    automaton.make_automaton()
+    return automaton
+
+DESIGNATOR_AUTOMATON = _build_designator_automaton() if ahocorasick is not None else None
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+def _find_company_candidates(text: str):
     """
-    Generates a list of simple, relevant, and actionable prompts (questions)
-    based on contract content (company names and key phrases) and loaded criteria
-    for a given workspace using an LLM.
-    Reads contract content directly from parsed.jsonl.
+    Yields raw company-name candidates (name + designator) from a contract text.
+    Uses a single Aho-Corasick pass for the designators when pyahocorasick is installed,
+    then matches the name prefix in a short window before each hit; otherwise falls back to COMPANY_PATTERN.
     """
-    generated_prompts = []
+    lowered = text.lower()
+    if DESIGNATOR_AUTOMATON is None or len(lowered) != len(text):
+        for match in COMPANY_PATTERN.finditer(text): # Use finditer to get match objects for spans
+            yield match.group(1)
+        return
+
+    last_end = 0 # Like finditer, candidates never overlap
+    for end_idx, length in DESIGNATOR_AUTOMATON.iter(lowered):
+        start = end_idx - length + 1
+        # Enforce the \b boundaries of COMPANY_DESIGNATORS
+        if start > 0 and _is_word_char(lowered[start - 1]):
+            continue
+        if end_idx + 1 < len(lowered) and _is_word_char(lowered[end_idx + 1]):
+            continue
+        prefix = COMPANY_PREFIX_PATTERN.search(text, max(last_end, start - 51), start)
+        if prefix:
+            yield text[prefix.start():end_idx + 1]
+            last_end = end_idx + 1
+WORD_PATTERN = re.compile(r'\b\w+\b')
+JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+PROMPTS_ARRAY_PATTERN = re.compile(r'"prompts"\s*:\s*\[')
+_JSON_DECODER = json.JSONDecoder()
+# Plain phrases (no regex features), matched with substring search
+PHRASES_TO_LOOK_FOR = (
+    "intellectual property", "payment terms", "termination clause",
+    "confidentiality agreement", "data privacy", "force majeure",
+    "governing law", "dispute resolution", "warranty period",
+    "indemnification", "limitation of liability", "service level agreement",
+    "effective date", "renewal terms", "exclusivity clause", "subcontracting"
+)
+
+def _extract_companies_from_text(text: str) -> Counter:
+    """Occurrence counts of company names (2-6 words, trailing punctuation removed) in one contract text."""
+    companies = Counter()
+    for candidate in _find_company_candidates(text):
+        company_name = TRAILING_PUNCT_PATTERN.sub('', candidate.strip()).strip() # Remove trailing commas/dots
+        if 1 < len(company_name.split()) <= 6: # Allow up to 6 words
+            companies[company_name] += 1
+    return companies
+
+def _iter_mmap_lines(f):
+    """Yields the non-empty lines of an open binary file by scanning a read-only mmap for newlines."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return # Empty files cannot be mapped
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < len(mm):
+            end = mm.find(b"\n", start)
+            if end == -1:
+                end = len(mm)
+            if end > start:
+                yield mm[start:end]
+            start = end + 1
+
+def _iter_parsed_lines(parsed_jsonl_path: Path, skip_file):
+    """
+    Yields raw JSONL lines (bytes) from parsed.jsonl.
+    When the parser's offset index is present and up to date, lines of files for which skip_file()
+    is true are never read or decoded; otherwise the whole file is scanned.
+    """
+    index_path = parsed_jsonl_path.with_suffix(".idx") # Offset index written by parser_service
+    try:
+        index_current = index_path.stat().st_mtime_ns >= parsed_jsonl_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        index_current = False
+
+    with open(parsed_jsonl_path, 'rb') as f:
+        if not index_current:
+            yield from _iter_mmap_lines(f)
+            return
+        with open(index_path, 'rb') as index_file:
+            for entry_line in index_file:
+                entry = _json_loads(entry_line)
+                if skip_file(entry["file"]):
+                    continue
+                f.seek(entry["offset"])
+                yield f.read(entry["length"])
+
+def _count_ngram_codes_numpy(word_ids, vocab_size, n):
+    """Unique n-gram codes and their counts, vectorized with NumPy."""
+    windows = word_ids.shape[0] - n + 1
+    codes = word_ids[:windows].copy()
+    for k in range(1, n):
+        codes = codes * vocab_size + word_ids[k:k + windows]
+    return np.unique(codes, return_counts=True)
+
+def _count_ngram_codes_loop(word_ids, vocab_size, n):
+    """Same result as _count_ngram_codes_numpy as one explicit loop, for JIT compilation with Numba."""
+    windows = word_ids.shape[0] - n + 1
+    codes = np.empty(windows, dtype=np.int64)
+    for i in range(windows):
+        code = 0
+        for k in range(n):
+            code = code * vocab_size + word_ids[i + k]
+        codes[i] = code
+    codes.sort()
+    uniq_codes = np.empty(windows, dtype=np.int64)
+    uniq_counts = np.empty(windows, dtype=np.int64)
+    m = 0
+    for i in range(windows):
+        if m > 0 and codes[i] == uniq_codes[m - 1]:
+            uniq_counts[m - 1] += 1
+        else:
+            uniq_codes[m] = codes[i]
+            uniq_counts[m] = 1
+            m += 1
+    return uniq_codes[:m], uniq_counts[:m]
+
+# The compiled loop fuses window coding and counting into one pass; cache=True keeps the machine code across restarts
+_count_ngram_codes = njit(cache=True)(_count_ngram_codes_loop) if njit is not None else _count_ngram_codes_numpy
+
+def _frequent_ngrams(words: List[str], min_count: int = NGRAM_MIN_COUNT) -> List[str]:
+    """
+    Bigrams and trigrams occurring more than min_count times, most frequent first.
+    Words are mapped to integer ids and every n-gram window to one int64 code, so counting runs in
+    native code (Numba or NumPy) and phrase strings are only rebuilt for the survivors.
+    """
+    vocab = {}
+    word_ids = np.fromiter((vocab.setdefault(w, len(vocab)) for w in words), dtype=np.int64, count=len(words))
+    vocab_words = list(vocab)
+    vocab_size = max(len(vocab_words), 1)
+
+    phrase_counts = []
+    for n in (2, 3):
+        windows = len(words) - n + 1
+        if windows <= 0:
+            continue
+        if vocab_size ** n >= 2 ** 63:
+            # Codes would overflow int64; count this order with plain tuples instead
+            counts = Counter(zip(*(words[k:k + windows] for k in range(n))))
+            phrase_counts.extend((" ".join(gram), count) for gram, count in counts.items() if count > min_count)
+            continue
+        uniq_codes, uniq_counts = _count_ngram_codes(word_ids, vocab_size, n)
+        keep = uniq_counts > min_count
+        for code, count in zip(uniq_codes[keep].tolist(), uniq_counts[keep].tolist()):
+            gram = []
+            for _ in range(n):
+                code, word_id = divmod(code, vocab_size)
+                gram.append(vocab_words[word_id])
+            phrase_counts.append((" ".join(reversed(gram)), count))
+
+    phrase_counts.sort(key=lambda item: item[1], reverse=True)
+    return [phrase for phrase, _ in phrase_counts]
+
+def _scan_prompt_strings(buffer: str, pos: int, prompts: List[str]) -> Tuple[int, bool]:
+    """
+    Decodes the complete string items of a JSON array in buffer, starting at pos, into prompts.
+    Returns the position to resume from and whether the array has ended (or holds a non-string item).
+    """
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buffer):
+            return pos, False
+        if buffer[pos] != '"':
+            return pos, True
+        try:
+            value, end = _JSON_DECODER.raw_decode(buffer, pos)
+        except ValueError:
+            return pos, False # String not fully received yet
+        prompts.append(value)
+        pos = end
+
+def _mtime_ns(path: Path):
+    """Modification time of a file in nanoseconds, or None if it does not exist."""
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+@functools.lru_cache(maxsize=64)
+def _build_llm_context(workspace_name: str, base_dir_str: str, parsed_mtime, criteria_mtime) -> Tuple[tuple, tuple, str]:
+    """
+    Extracts company names, keywords and criteria context for prompt generation.
+    Cached on the input files' mtimes, so unchanged workspaces skip the file scan and text mining;
+    the LLM call itself is not cached since prompts are sampled with temperature 0.7.
+    """
+    base_dir = Path(base_dir_str)
 
     # 1. Get all contract texts for the workspace directly from parsed.jsonl
     parsed_jsonl_path = base_dir / "data" / workspace_name / "parsed.jsonl"
@@ -49,20 +309,33 @@ def generate_ai_prompts(workspace_name: str, base_dir: Path) -> List[str]:
         logger.warning(f"parsed.jsonl not found for workspace '{workspace_name}' at {parsed_jsonl_path}. Skipping contract text extraction for prompt generation.")
     else:
         try:
-            with open(parsed_jsonl_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    try:
-                        doc = json.loads(line)
-                        file_name = doc.get("file", "unknown_file")
-                        text_content = doc.get("text", "")
-                        contract_texts_map[file_name] = contract_texts_map.get(file_name, "") + text_content + "\n"
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"Skipping malformed JSON line in {parsed_jsonl_path}: {line.strip()} - {e}")
-                        continue
+            # Collect per-file pieces up to the character budget instead of concatenating then slicing
+            contract_parts = {}
+            contract_lengths = {}
+            def budget_filled(file_name):
+                return contract_lengths.get(file_name, 0) >= CONTRACT_TEXT_CHAR_LIMIT
 
-            # Truncate texts for prompt to avoid exceeding context window
-            for key in contract_texts_map:
-                contract_texts_map[key] = contract_texts_map[key][:8000] # Truncate to avoid API limits
+            for line in _iter_parsed_lines(parsed_jsonl_path, budget_filled):
+                try:
+                    doc = _json_loads(line)
+                    file_name = doc.get("file", "unknown_file")
+                    used = contract_lengths.get(file_name, 0)
+                    remaining = CONTRACT_TEXT_CHAR_LIMIT - used
+                    if remaining <= 0:
+                        continue # Budget for this file already filled
+                    piece = doc.get("text", "")[:remaining]
+                    parts = contract_parts.setdefault(file_name, [])
+                    parts.append(piece)
+                    used += len(piece)
+                    if used < CONTRACT_TEXT_CHAR_LIMIT:
+                        parts.append("\n")
+                        used += 1
+                    contract_lengths[file_name] = used
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Skipping malformed JSON line in {parsed_jsonl_path}: {line.strip().decode('utf-8', 'replace')} - {e}")
+                    continue
+
+            contract_texts_map = {file_name: "".join(parts) for file_name, parts in contract_parts.items()}
 
         except Exception as e:
             logger.warning(f"Could not read or process parsed.jsonl for prompt generation: {e}")
@@ -71,62 +344,40 @@ def generate_ai_prompts(workspace_name: str, base_dir: Path) -> List[str]:
     # --- ENHANCED DATA RETRIEVAL START ---
 
     # 2. Extract company names
-    extracted_companies = set()
-    company_designators = r'\b(?:LLC|Inc|Corp|Limited|Ltd|Company|Co|Corporation|Group|Holdings|Solutions|Technologies|Services|Associates|Partners|Ventures|Systems|Global|International|Digital|Pte?\.? Ltd|GmbH|AG|SA|AB|NV|BV|PLC|S\.A\.S)\b'
-    company_pattern = re.compile(
-        r'([A-Z][a-zA-Z0-9\s,\.&-]{1,50}?' + company_designators + r')', # Captures actual name + designator
-        re.IGNORECASE
-    )
-
-    for text in contract_texts_map.values():
-        for match in company_pattern.finditer(text): # Use finditer to get match objects for spans
-            company_name = match.group(1).strip()
-            company_name = re.sub(r'[,\.]+$', '', company_name).strip() # Remove trailing commas/dots
-            if len(company_name.split()) > 1 and len(company_name.split()) <= 6: # Allow up to 6 words
-                extracted_companies.add(company_name)
+    companies_freq = Counter()
+    for counts in map(_extract_companies_from_text, contract_texts_map.values()):
+        companies_freq.update(counts)
 
     common_phrases_to_exclude = {
         "the company", "this company", "any company", "all company",
         "the corporation", "this corporation", "terms and conditions",
         "party a", "party b", "contracting party"
     }
-    company_names = [
-        name for name in extracted_companies
-        if name.lower() not in common_phrases_to_exclude and len(name.split()) > 1 # Must be multi-word
-    ]
-    company_names = list(set(company_names))[:5] # Limit to top 5 relevant companies for conciseness
+    # Keep the 5 most frequently mentioned companies for conciseness (names are already multi-word)
+    company_names = heapq.nlargest(
+        5,
+        (name for name in companies_freq if name.lower() not in common_phrases_to_exclude),
+        key=companies_freq.__getitem__
+    )
 
     # 3. Simple Keyword/Keyphrase Identification
-    all_combined_text = " ".join(contract_texts_map.values()).lower()
-
-    common_contract_phrases = set()
-    phrases_to_look_for = [
-        r"intellectual property", r"payment terms", r"termination clause",
-        r"confidentiality agreement", r"data privacy", r"force majeure",
-        r"governing law", r"dispute resolution", r"warranty period",
-        r"indemnification", r"limitation of liability", r"service level agreement",
-        r"effective date", r"renewal terms", r"exclusivity clause", r"subcontracting"
-    ]
-
-    for phrase_pattern in phrases_to_look_for:
-        if re.search(phrase_pattern, all_combined_text):
-            common_contract_phrases.add(phrase_pattern.replace(r'\b', '').strip()) # Add cleaned phrase
-
-    word_counts = {}
-    words = re.findall(r'\b\w+\b', all_combined_text)
-    for i in range(len(words) - 1):
-        phrase = words[i] + " " + words[i+1]
-        word_counts[phrase] = word_counts.get(phrase, 0) + 1
-        if i < len(words) - 2:
-            phrase_three = phrase + " " + words[i+2]
-            word_counts[phrase_three] = word_counts.get(phrase_three, 0) + 1
-
-    frequent_phrases = [
-        p for p, count in word_counts.items()
-        if count > 5 and len(p.split()) > 1 and len(p.split()) < 5 # 2 to 4 words
-        and p.lower() not in common_phrases_to_exclude # Exclude common stop phrases
-    ]
-    extracted_keywords = list(set(list(common_contract_phrases) + frequent_phrases))[:5] # Combine and limit to top 5 for conciseness
+    # Lowercase per contract while joining so the full text is only materialized once;
+    # this one string feeds both the phrase scan and the tokenizer
+    all_combined_text = " ".join(text.lower() for text in contract_texts_map.values())
+
+    common_contract_phrases = [phrase for phrase in PHRASES_TO_LOOK_FOR if phrase in all_combined_text] # Curated order
+
+    if PROMPT_GEN_NGRAM_KEYWORDS:
+        words = WORD_PATTERN.findall(all_combined_text)
+        frequent_phrases = [
+            p for p in _frequent_ngrams(words) # Only 2- and 3-word phrases are counted
+            if p not in common_phrases_to_exclude # Exclude common stop phrases (text is already lowercase)
+        ]
+        # Curated phrases first, then the most frequent n-grams; dedupe in order and keep the top 5
+        extracted_keywords = list(dict.fromkeys(common_contract_phrases + frequent_phrases))[:5]
+    else:
+        # The curated phrase list already covers the concepts the prompt needs
+        extracted_keywords = common_contract_phrases[:5]
 
     # --- ENHANCED DATA RETRIEVAL END ---
 
@@ -142,55 +393,76 @@ def generate_ai_prompts(workspace_name: str, base_dir: Path) -> List[str]:
             logger.warning(f"Could not extract criteria for prompt generation from {criteria_path}: {e}")
             criteria_context = ""
 
-    # 5. Construct LLM prompt with richer context and new instructions
-    llm_prompt = f"""
-You are an expert in contract analysis and business intelligence.
-Your task is to generate 10 diverse, very simple, short and highly relevant prompts (questions)
-that a user might ask about contracts, the answers to these questions should be easily extractable.
-These prompts should be actionable and cover information extraction, comparison, or evaluation aspects.
-Focus on common contract elements, key entities, and any specific criteria provided.
-Ensure the questions are direct and can be answered from a contract document.
+    return tuple(company_names), tuple(extracted_keywords), criteria_context
 
-### Context for Prompt Generation:
-"""
 
+async def _load_llm_context(workspace_name: str, base_dir: Path) -> Tuple[tuple, tuple, str]:
+    """Cached prompt-generation context for a workspace; file reads and text mining run off the event loop."""
+    parsed_jsonl_path = base_dir / "data" / workspace_name / "parsed.jsonl"
+    criteria_path = base_dir / "data" / workspace_name / "cleaned_criteria.json"
+    return await asyncio.to_thread(
+        _build_llm_context, workspace_name, str(base_dir), _mtime_ns(parsed_jsonl_path), _mtime_ns(criteria_path)
+    )
+
+def _context_lines(company_names, extracted_keywords, criteria_context) -> List[str]:
+    """Context section lines of the prompt-generation prompt."""
+    lines = []
     if company_names:
-        llm_prompt += f"- Key Entities (Companies): {', '.join(company_names)}\n"
+        lines.append(f"- Key Entities (Companies): {', '.join(company_names)}\n")
     if extracted_keywords:
-        llm_prompt += f"- Important Concepts/Keywords: {', '.join(extracted_keywords)}\n"
+        lines.append(f"- Important Concepts/Keywords: {', '.join(extracted_keywords)}\n")
     if criteria_context:
-        llm_prompt += f"- Specific Evaluation Criteria: {criteria_context}\n"
-    if not company_names and not extracted_keywords and not criteria_context:
-        llm_prompt += "No specific entities, keywords, or criteria provided. Generate general simple contract analysis prompts.\n"
+        lines.append(f"- Specific Evaluation Criteria: {criteria_context}\n")
+    if not lines:
+        lines.append("No specific entities, keywords, or criteria provided. Generate general simple contract analysis prompts.\n")
+    return lines
 
-    llm_prompt += """
-Generate exactly 10 prompts.
-Prioritize clarity, simplicity, relevance, and actionability.
-Your output must be a JSON array of strings, like this:
-{
-  "prompts": [
-    "Prompt 1: ...",
-    "Prompt 2: ...",
-    "Prompt 3: ...",
-    "..."
-  ]
-}
-"""
+async def generate_ai_prompts(workspace_name: str, base_dir: Path) -> List[str]:
+    """
+    Generates a list of simple, relevant, and actionable prompts (questions)
+    based on contract content (company names and key phrases) and loaded criteria
+    for a given workspace using an LLM.
+    Reads contract content directly from parsed.jsonl.
+    """
+    generated_prompts = []
+
+    company_names, extracted_keywords, criteria_context = await _load_llm_context(workspace_name, Path(base_dir))
+
+    # 5. Construct LLM prompt with richer context and new instructions
+    parts = [LLM_PROMPT_HEADER, *_context_lines(company_names, extracted_keywords, criteria_context), LLM_PROMPT_FOOTER]
+    llm_prompt = "".join(parts)
     logger.info(f"🧠 Prompt for AI generation character length: {len(llm_prompt)}")
 
     # 6. Call LLM and parse response
     try:
-        # UNPACK THE TUPLE HERE!
-        response_text_raw, openrouter_time_elapsed = call_openrouter(llm_prompt, model_name=SMALL_PROMPT_GEN_MODEL, temperature=0.7)
-        
-        # Now, use response_text_raw which is the string you need to strip
-        response_text = response_text_raw.strip()
-        
-        if response_text.startswith("```"):
-            response_text = re.sub(r"^```(?:json)?\s*", "", response_text, flags=re.IGNORECASE)
-            response_text = re.sub(r"\s*```$", "", response_text)
-
-        parsed_response = json.loads(response_text)
+        # Stream the reply and decode each prompt string as soon as it is complete, so generation
+        # can be cancelled once enough prompts have arrived or the array closes
+        response_text_raw = ""
+        streamed_prompts = []
+        scan_pos = None # Position inside the "prompts" array to resume decoding from
+        async with contextlib.aclosing(stream_openrouter_async(
+            llm_prompt, model_name=SMALL_PROMPT_GEN_MODEL, temperature=0.7, response_format=PROMPT_GEN_RESPONSE_FORMAT
+        )) as deltas:
+            async for delta in deltas:
+                response_text_raw += delta
+                if scan_pos is None:
+                    match = PROMPTS_ARRAY_PATTERN.search(response_text_raw)
+                    if not match:
+                        continue
+                    scan_pos = match.end()
+                scan_pos, array_closed = _scan_prompt_strings(response_text_raw, scan_pos, streamed_prompts)
+                if array_closed or len(streamed_prompts) >= PROMPT_GEN_COUNT:
+                    break # Leaving the stream closes the response and stops the generation
+        if streamed_prompts:
+            return streamed_prompts[:PROMPT_GEN_COUNT]
+
+        # No prompts decoded incrementally; parse the whole reply as before
+        try:
+            parsed_response = _json_loads(response_text_raw)
+        except ValueError:
+            # Models that ignore JSON mode may wrap the object in code fences or commentary
+            match = JSON_OBJECT_PATTERN.search(response_text_raw)
+            parsed_response = _json_loads(match.group(0) if match else response_text_raw)
         generated_prompts = parsed_response.get("prompts", [])
 
         if isinstance(generated_prompts, list) and all(isinstance(p, str) for p in generated_prompts):
@@ -201,4 +473,4 @@ Your output must be a JSON array of strings, like this:
 
     except Exception as e:
         logger.error(f"Error generating AI prompts: {e}")
-        return []
\ No newline at end of file
+        return []
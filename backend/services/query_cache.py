@@ -0,0 +1,120 @@
+# backend/services/query_cache.py
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Recent query embeddings and their Qdrant hits, kept in process memory. Embeddings are
+# L2-normalized, so a dot product against the cached vectors is their cosine similarity.
+QUERY_CACHE_MAX_SIZE = 2000
+QUERY_CACHE_TTL_SECONDS = 600
+SEMANTIC_HIT_THRESHOLD = 0.97
+
+def _query_key(query: str) -> str:
+    normalized = " ".join(query.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class QueryEmbeddingCache:
+    """
+    Thread-safe LRU + TTL cache of query embeddings and of the search hits they produced.
+    Hits are stored per (collection, limit) and reused for any later query whose embedding
+    is within SEMANTIC_HIT_THRESHOLD cosine of a cached one.
+    """
+
+    def __init__(self, max_size: int = QUERY_CACHE_MAX_SIZE, ttl_seconds: int = QUERY_CACHE_TTL_SECONDS,
+                 threshold: float = SEMANTIC_HIT_THRESHOLD):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._lock = threading.RLock()
+        self._vectors = OrderedDict()  # query key -> (vector, expires_at)
+        self._hits = {}  # (collection, limit) -> OrderedDict[vector digest -> (vector, hits, expires_at)]
+        self._collection_values = {}  # (collection, name) -> (value, expires_at), e.g. the file list
+
+    def get(self, query: str):
+        key = _query_key(query)
+        with self._lock:
+            entry = self._vectors.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._vectors[key]
+                return None
+            self._vectors.move_to_end(key)
+            return entry[0]
+
+    def put(self, query: str, vector) -> None:
+        key = _query_key(query)
+        with self._lock:
+            self._vectors[key] = (np.asarray(vector, dtype=np.float32), time.time() + self.ttl_seconds)
+            self._vectors.move_to_end(key)
+            if len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+
+    def get_or_compute(self, query: str, encode):
+        """Cached embedding for the query, calling encode(query) on a miss."""
+        vector = self.get(query)
+        if vector is None:
+            # Encoding runs outside the lock so concurrent misses don't serialize on the model
+            vector = np.asarray(encode(query), dtype=np.float32)
+            self.put(query, vector)
+        return vector
+
+    def get_hits(self, collection_name: str, limit: int, vector, threshold: float = None):
+        """
+        Hits cached for the most similar earlier query, or None if none is close enough.
+        threshold overrides the cache's similarity cutoff for callers that accept looser matches.
+        """
+        with self._lock:
+            entries = self._hits.get((collection_name, limit))
+            if not entries:
+                return None
+            now = time.time()
+            for key in [key for key, entry in entries.items() if entry[2] <= now]:
+                del entries[key]
+            if not entries:
+                return None
+            keys = list(entries)
+            matrix = np.stack([entries[key][0] for key in keys])
+            scores = matrix @ np.asarray(vector, dtype=np.float32)
+            best = int(np.argmax(scores))
+            if scores[best] < (self.threshold if threshold is None else threshold):
+                return None
+            entries.move_to_end(keys[best])
+            logger.info(f"[QueryCache] Reusing hits for '{collection_name}' (similarity {scores[best]:.3f})")
+            return entries[keys[best]][1]
+
+    def put_hits(self, collection_name: str, limit: int, vector, hits: list) -> None:
+        key = hashlib.sha256(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+        with self._lock:
+            entries = self._hits.setdefault((collection_name, limit), OrderedDict())
+            entries[key] = (np.asarray(vector, dtype=np.float32), hits, time.time() + self.ttl_seconds)
+            entries.move_to_end(key)
+            if len(entries) > self.max_size:
+                entries.popitem(last=False)
+
+    def get_collection_value(self, collection_name: str, name: str):
+        """A cached per-collection value (such as its distinct source files), or None."""
+        with self._lock:
+            entry = self._collection_values.get((collection_name, name))
+            if entry is None or entry[1] <= time.time():
+                return None
+            return entry[0]
+
+    def put_collection_value(self, collection_name: str, name: str, value) -> None:
+        with self._lock:
+            self._collection_values[(collection_name, name)] = (value, time.time() + self.ttl_seconds)
+
+    def invalidate(self, collection_name: str) -> None:
+        """Drop cached hits and values for a collection whose points changed; embeddings stay valid."""
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._hits if cache_key[0] == collection_name]:
+                del self._hits[cache_key]
+            for cache_key in [cache_key for cache_key in self._collection_values if cache_key[0] == collection_name]:
+                del self._collection_values[cache_key]
+
+query_cache = QueryEmbeddingCache()
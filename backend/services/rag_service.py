@@ -1,23 +1,43 @@
 # services/rag_service.py
 import os
+import asyncio
 import json
-import hashlib
-import requests
+import functools
+import itertools
+import httpx
+import xxhash
 import re
 import concurrent.futures
 import time
+import statistics
+import numpy as np
 from pathlib import Path
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue, OptimizersConfigDiff, SearchRequest, SearchParams, QuantizationSearchParams
 from sentence_transformers import SentenceTransformer
+from bs4 import BeautifulSoup
 import logging
 import collections  # Import collections for defaultdict
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlparse, urlunparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import tiktoken
+    _TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken missing or its BPE file could not be fetched
+    _TOKEN_ENCODING = None
 
 logger = logging.getLogger(__name__)
 
 from services.helper_service import extract_criteria_from_jsonl
+from services.query_cache import query_cache
+from services.embed_cache import embed_cache
+from services.embedder_service import RAG_QUANTIZATION_CONFIG, RAG_HNSW_CONFIG
 
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -27,14 +47,203 @@ OPENROUTER_MODEL = "qwen/qwq-32b"
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
 client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-model = SentenceTransformer("all-MiniLM-L6-v2")
+QDRANT_INDEXING_THRESHOLD = 20000 # Qdrant's default, restored after bulk uploads
+QDRANT_UPLOAD_CONCURRENCY = int(os.getenv("QDRANT_UPLOAD_CONCURRENCY", "2"))
+# Search the quantized vectors with 2x oversampling, then rescore the candidates against the originals
+RAG_SEARCH_PARAMS = SearchParams(hnsw_ef=128, quantization=QuantizationSearchParams(rescore=True, oversampling=2.0))
+# Partial results after a crawl timeout: a narrower HNSW beam over the quantized vectors only
+RAG_PARTIAL_SEARCH_PARAMS = SearchParams(hnsw_ef=64, quantization=QuantizationSearchParams(ignore=False, rescore=False))
+
+def _detect_device() -> str:
+    """Pick the fastest available torch device for the embedding model."""
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+    except Exception:
+        pass
+    return "cpu"
 
-def call_openrouter(prompt: str, model_name: str = OPENROUTER_MODEL, temperature: float = 0.0) -> str:
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
+EMBEDDING_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+# INT8 ONNX Runtime encoder for CPU-only hosts; off by default since the first start exports the model
+RAG_ONNX_ENCODER = os.getenv("RAG_ONNX_ENCODER", "false").lower() == "true"
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", "models/all-MiniLM-L6-v2-onnx-int8"))
+ONNX_QUANTIZED_FILE = "model_quantized.onnx"
+ONNX_MAX_SEQ_LENGTH = 256 # matches the SentenceTransformer config for all-MiniLM-L6-v2
+
+class OnnxEncoder:
+    """
+    Dynamically quantized (INT8) ONNX export of all-MiniLM-L6-v2 with mean pooling.
+    Exposes the subset of the SentenceTransformer interface used by the services.
+    """
+
+    def __init__(self, model_id: str, save_dir: Path):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        if not (save_dir / ONNX_QUANTIZED_FILE).exists():
+            # Export and quantize once; later starts load the saved model directly
+            logger.info(f"[Embeddings] Exporting {model_id} to quantized ONNX in {save_dir}")
+            export_dir = save_dir / "fp32"
+            ORTModelForFeatureExtraction.from_pretrained(model_id, export=True).save_pretrained(export_dir)
+            quantizer = ORTQuantizer.from_pretrained(export_dir)
+            qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=True)
+            quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(save_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(save_dir)
+        self.ort_model = ORTModelForFeatureExtraction.from_pretrained(
+            save_dir, file_name=ONNX_QUANTIZED_FILE, provider="CPUExecutionProvider"
+        )
+        self.dimension = self.ort_model.config.hidden_size
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = True, show_progress_bar: bool = False):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        # Batch texts of similar length together so short texts aren't padded to a long neighbour;
+        # rows are written back at their original positions
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(texts), batch_size):
+            batch_idx = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in batch_idx], padding=True, truncation=True,
+                max_length=ONNX_MAX_SEQ_LENGTH, return_tensors="np"
+            )
+            hidden = self.ort_model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            embeddings[batch_idx] = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        # all-MiniLM-L6-v2 ends in a Normalize module, so unit-length output keeps vectors
+        # compatible with collections embedded by SentenceTransformer
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
+def _load_embedding_model():
+    device = _detect_device()
+    if RAG_ONNX_ENCODER and device == "cpu":
+        try:
+            return OnnxEncoder(EMBEDDING_MODEL_ID, ONNX_MODEL_DIR)
+        except Exception as e:
+            logger.warning(f"[Embeddings] ONNX encoder unavailable, falling back to SentenceTransformer: {e}")
+    return SentenceTransformer("all-MiniLM-L6-v2", device=device)
+
+model = _load_embedding_model()
+# Namespace for persisted chunk embeddings; the ONNX INT8 model's vectors differ slightly from torch's
+EMBEDDING_CACHE_MODEL = f"{EMBEDDING_MODEL_ID}:{'onnx-int8' if isinstance(model, OnnxEncoder) else 'torch'}"
+
+def _encode_texts(texts: list[str]):
+    return model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+
+def search_queries(collection_name: str, queries: list[str], top_k: int, hit_threshold: float = None,
+                   search_params: SearchParams = RAG_SEARCH_PARAMS) -> list[list]:
+    """
+    Semantic search for several queries against one collection.
+    Uncached queries are embedded in one encode call and searched in one search_batch request;
+    near-duplicate recent queries reuse the cached hits (hit_threshold overrides the cache's cutoff).
+    Only hits from the default search_params are cached, so cheaper searches never stand in for full ones.
+    """
+    vectors = [query_cache.get(query) for query in queries]
+    to_encode = [i for i, vector in enumerate(vectors) if vector is None]
+    if to_encode:
+        encoded = model.encode([queries[i] for i in to_encode], batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        for i, vector in zip(to_encode, encoded):
+            vectors[i] = vector
+            query_cache.put(queries[i], vector)
+
+    results = [query_cache.get_hits(collection_name, top_k, vector, hit_threshold) for vector in vectors]
+    to_search = [i for i, hits in enumerate(results) if hits is None]
+    if to_search:
+        batch_hits = client.search_batch(
+            collection_name=collection_name,
+            requests=[
+                SearchRequest(vector=vectors[i].tolist(), limit=top_k, with_payload=True, params=search_params)
+                for i in to_search
+            ],
+        )
+        for i, hits in zip(to_search, batch_hits):
+            results[i] = hits
+            if search_params is RAG_SEARCH_PARAMS:
+                query_cache.put_hits(collection_name, top_k, vectors[i], hits)
+    return results
+
+def _collection_file_names(collection_name: str) -> list[str]:
+    """
+    Distinct source files in a collection, cached until the collection is next written to.
+    Uses a facet over the source_file keyword index rather than scrolling every point.
+    """
+    file_names = query_cache.get_collection_value(collection_name, "source_files")
+    if file_names is None:
+        try:
+            facet = client.facet(collection_name=collection_name, key="source_file", limit=10_000)
+            file_names = [hit.value for hit in facet.hits if hit.value]
+        except Exception as e:
+            # Collections embedded before the source_file index existed can't be faceted
+            logger.warning(f"[Qdrant] Facet on '{collection_name}' failed, scrolling instead: {e}")
+            hits, _ = client.scroll(collection_name=collection_name, limit=10000, with_payload=["source_file"], with_vectors=False)
+            file_names = list({hit.payload.get("source_file", "") for hit in hits if hit.payload.get("source_file", "")})
+        query_cache.put_collection_value(collection_name, "source_files", file_names)
+    return file_names
+
+def _search_cached(collection_name: str, query: str, top_k: int, hit_threshold: float = None,
+                   search_params: SearchParams = RAG_SEARCH_PARAMS):
+    """Single-query form of search_queries."""
+    return search_queries(collection_name, [query], top_k, hit_threshold, search_params)[0]
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+_JSON_OBJ_RE = re.compile(r'\{.*\}', re.DOTALL) # Outermost JSON object in an LLM reply
+_FENCE_OPEN = re.compile(r"^```(?:json)?\s*", re.IGNORECASE)
+_FENCE_CLOSE = re.compile(r"\s*```$")
+
+def _json_loads(data):
+    """Parse JSON from str or bytes, using orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _strip_fence(text: str) -> str:
+    """Strip surrounding whitespace and a ```json ... ``` markdown fence from an LLM reply."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = _FENCE_CLOSE.sub("", _FENCE_OPEN.sub("", text))
+    return text
+# Shared async client for OpenRouter, ChatGPT and page fetches: keep-alive connections and
+# HTTP/2 multiplexing avoid a TLS handshake per call. Relative paths resolve against OpenRouter.
+async_http_client = httpx.AsyncClient(
+    base_url=OPENROUTER_BASE_URL,
+    http2=True,
+    timeout=httpx.Timeout(600.0, connect=10.0),
+    limits=httpx.Limits(max_keepalive_connections=64),
+)
+
+# Sync counterpart for the LLM calls and page fetches that run concurrently from worker threads
+# (llm_executor, the Redis worker); httpx.Client is thread-safe and multiplexes them the same way.
+http_client = httpx.Client(
+    http2=True,
+    timeout=httpx.Timeout(600.0, connect=10.0),
+    limits=httpx.Limits(max_keepalive_connections=64),
+)
+
+async def close_clients() -> None:
+    """Close the shared HTTP clients (called on application shutdown)."""
+    await async_http_client.aclose()
+    http_client.close()
+
+# Request headers are fixed for the life of the process, so build them once instead of per call
+_OR_HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json",
+}
+_OAI_HEADERS = {
+    "Authorization": f"Bearer {OPENAI_API_KEY}",
+    "Content-Type": "application/json",
+}
+
+def _openrouter_request(prompt: str, model_name: str, temperature: float, response_format: dict = None):
     data = {
         "model": model_name,
         "messages": [
@@ -50,34 +259,91 @@ def call_openrouter(prompt: str, model_name: str = OPENROUTER_MODEL, temperature
         ],
         "temperature": temperature,
     }
+    if response_format:
+        data["response_format"] = response_format
+    return _OR_HEADERS, data
+
+def _extract_json_object(reply_text: str) -> str:
+    match = _JSON_OBJ_RE.search(reply_text)
+    if match:
+        return match.group(0)
+    return reply_text
+
+def call_openrouter(prompt: str, model_name: str = OPENROUTER_MODEL, temperature: float = 0.0) -> str:
+    url = f"{OPENROUTER_BASE_URL}/chat/completions"
+    headers, data = _openrouter_request(prompt, model_name, temperature)
     try:
         logger.info(f"[OpenRouter] Sending request to model: {model_name}, prompt length: {len(prompt)}")
         start_request_time = time.time()
-        resp = requests.post(url, headers=headers, json=data, timeout=600)
+        resp = http_client.post(url, headers=headers, json=data)
         resp.raise_for_status()
         reply_text = resp.json()["choices"][0]["message"]["content"]
         logger.info(f"[OpenRouter] Response received in {time.time() - start_request_time:.2f}s.")
         openrouter_elapsed = time.time() - start_request_time
-        match = re.search(r'\{.*\}', reply_text, re.DOTALL)
-        if match:
-            return match.group(0), openrouter_elapsed
-        return reply_text, openrouter_elapsed
-    except requests.exceptions.Timeout:
+        return _extract_json_object(reply_text), openrouter_elapsed
+    except httpx.TimeoutException:
         logger.error(f"[OpenRouter] Request to {model_name} timed out after 600 seconds.")
         raise
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"[OpenRouter] Request to {model_name} failed: {e}")
-        if hasattr(e, 'response') and e.response is not None:
+        if isinstance(e, httpx.HTTPStatusError):
             logger.error(f"[OpenRouter] Response status: {e.response.status_code}, content: {e.response.text}")
         raise
 
-def call_chatgpt(prompt: str, model_name: str = "gpt-4o", temperature: float = 0.0) -> str:
-    """Makes a call to the ChatGPT API."""
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-    }
+async def call_openrouter_async(prompt: str, model_name: str = OPENROUTER_MODEL, temperature: float = 0.0, response_format: dict = None) -> tuple[str, float]:
+    """
+    Async variant of call_openrouter over the shared pooled HTTP client.
+    With a response_format (e.g. JSON mode) the reply is returned as-is instead of regex-extracted.
+    """
+    headers, data = _openrouter_request(prompt, model_name, temperature, response_format)
+    try:
+        logger.info(f"[OpenRouter] Sending async request to model: {model_name}, prompt length: {len(prompt)}")
+        start_request_time = time.time()
+        resp = await async_http_client.post("/chat/completions", headers=headers, json=data)
+        resp.raise_for_status()
+        reply_text = resp.json()["choices"][0]["message"]["content"]
+        openrouter_elapsed = time.time() - start_request_time
+        logger.info(f"[OpenRouter] Response received in {openrouter_elapsed:.2f}s.")
+        if response_format:
+            return reply_text, openrouter_elapsed
+        return _extract_json_object(reply_text), openrouter_elapsed
+    except httpx.TimeoutException:
+        logger.error(f"[OpenRouter] Request to {model_name} timed out after 600 seconds.")
+        raise
+    except httpx.HTTPError as e:
+        logger.error(f"[OpenRouter] Request to {model_name} failed: {e}")
+        if isinstance(e, httpx.HTTPStatusError):
+            logger.error(f"[OpenRouter] Response status: {e.response.status_code}, content: {e.response.text}")
+        raise
+
+async def stream_openrouter_async(prompt: str, model_name: str = OPENROUTER_MODEL, temperature: float = 0.0, response_format: dict = None):
+    """
+    Yields reply text deltas from a streamed OpenRouter completion.
+    Closing the generator early closes the HTTP response, which cancels the rest of the generation upstream.
+    """
+    headers, data = _openrouter_request(prompt, model_name, temperature, response_format)
+    data["stream"] = True
+    logger.info(f"[OpenRouter] Streaming request to model: {model_name}, prompt length: {len(prompt)}")
+    async with async_http_client.stream("POST", "/chat/completions", headers=headers, json=data) as resp:
+        if resp.is_error:
+            await resp.aread()
+            logger.error(f"[OpenRouter] Response status: {resp.status_code}, content: {resp.text}")
+            resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            # Server-sent events; lines starting with ':' are keep-alive comments
+            if not line.startswith("data: "):
+                continue
+            payload = line[len("data: "):].strip()
+            if payload == "[DONE]":
+                break
+            choices = _json_loads(payload).get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+def _chatgpt_request(prompt: str, model_name: str, temperature: float):
     data = {
         "model": model_name,
         "messages": [
@@ -86,30 +352,98 @@ def call_chatgpt(prompt: str, model_name: str = "gpt-4o", temperature: float = 0
         ],
         "temperature": temperature,
     }
+    return _OAI_HEADERS, data
+
+def call_chatgpt(prompt: str, model_name: str = "gpt-4o", temperature: float = 0.0) -> str:
+    """Makes a call to the ChatGPT API."""
+    headers, data = _chatgpt_request(prompt, model_name, temperature)
     try:
         logger.info(f"[ChatGPT] Sending request to model: {model_name}, prompt length: {len(prompt)}")
         start_request_time = time.time()
-        resp = requests.post(url, headers=headers, json=data, timeout=600)
+        resp = http_client.post(OPENAI_CHAT_URL, headers=headers, json=data)
         resp.raise_for_status()
         reply_text = resp.json()["choices"][0]["message"]["content"]
         logger.info(f"[ChatGPT] Response received in {time.time() - start_request_time:.2f}s.")
         chatgpt_elapsed = time.time() - start_request_time
         return reply_text, chatgpt_elapsed
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error(f"[ChatGPT] Request to {model_name} timed out after 600 seconds.")
         raise
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"[ChatGPT] Request to {model_name} failed: {e}")
-        if hasattr(e, 'response') and e.response is not None:
+        if isinstance(e, httpx.HTTPStatusError):
             logger.error(f"[ChatGPT] Response status: {e.response.status_code}, content: {e.response.text}")
         raise
 
+# Shared pool for the blocking LLM calls. Hedged duplicates keep running here after a faster copy
+# wins, without holding up the caller the way a per-request `with ThreadPoolExecutor()` would.
+llm_executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm")
+# Hedging sends duplicate (paid) requests, so it stays off unless explicitly enabled
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_TIMEOUT_MEDIAN_FACTOR = 1.3
+LLM_LATENCY_MIN_SAMPLES = 10
+# Per (call site, call function), in seconds: a short summary and a long scoring prompt through
+# the same call_openrouter have very different latencies and must not share a median
+_llm_latencies = collections.defaultdict(lambda: collections.deque(maxlen=100))
+
+def _llm_timeout(call_site: str, fn):
+    """
+    Hedging timeout: 1.3x the rolling median latency of fn at this call site, never below LLM_TIMEOUT_S.
+    None (no hedging) when LLM_HEDGING is off or until LLM_LATENCY_MIN_SAMPLES calls have completed.
+    """
+    if not LLM_HEDGING:
+        return None
+    latencies = _llm_latencies[(call_site, fn.__name__)]
+    if len(latencies) < LLM_LATENCY_MIN_SAMPLES:
+        return None
+    return max(LLM_TIMEOUT_S, statistics.median(latencies) * LLM_TIMEOUT_MEDIAN_FACTOR)
+
+def _submit_llm(call_site: str, fn, *args) -> concurrent.futures.Future:
+    """
+    Submit call_openrouter/call_chatgpt to llm_executor. Every copy that succeeds records its
+    latency, including hedged copies that lose the race, so the median isn't biased to the fast tail.
+    """
+    future = llm_executor.submit(fn, *args)
+
+    def record_latency(done: concurrent.futures.Future):
+        if not done.cancelled() and done.exception() is None:
+            _llm_latencies[(call_site, fn.__name__)].append(done.result()[1])
+
+    future.add_done_callback(record_latency)
+    return future
+
+def _hedged_result(future: concurrent.futures.Future, call_site: str, fn, *args):
+    """
+    Result of an LLM call submitted with _submit_llm. With LLM_HEDGING on, each time the timeout passes
+    with no copy finished, another copy of the call is sent (up to LLM_MAX_ATTEMPTS in flight); the first
+    to succeed wins. A failed copy only raises once no other copy is still in flight.
+    The last attempt is waited on without a timeout, so a slow provider is never cut off.
+    """
+    pending = {future}
+    attempts = 1
+    failed = None
+    while True:
+        timeout = _llm_timeout(call_site, fn) if attempts < LLM_MAX_ATTEMPTS else None
+        done, pending = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        for finished in done:
+            if finished.exception() is None:
+                return finished.result()
+            failed = finished
+        if not pending:
+            return failed.result()  # Every copy failed; re-raise the last error
+        if not done:
+            attempts += 1
+            logger.warning(f"[LLM] {call_site}/{fn.__name__} exceeded {timeout:.1f}s, sending attempt {attempts}/{LLM_MAX_ATTEMPTS}")
+            pending.add(_submit_llm(call_site, fn, *args))
+
+def call_llm_hedged(call_site: str, fn, *args):
+    """Blocking call_openrouter/call_chatgpt, hedged on slow responses when LLM_HEDGING is on."""
+    return _hedged_result(_submit_llm(call_site, fn, *args), call_site, fn, *args)
+
 
 # from duckduckgo_search import DDGS
-import requests
-from bs4 import BeautifulSoup
-import os
-import re
 
 # --- URL normalization and Qdrant collection helper ---
 def ensure_url_has_scheme(url: str) -> str:
@@ -117,6 +451,107 @@ def ensure_url_has_scheme(url: str) -> str:
         return "https://" + url.lstrip("/")
     return url
 
+@functools.lru_cache(maxsize=10_000)
+def _normalize_url(url: str) -> str:
+    """Canonical form of a page URL (trailing slash removed from the path) used to group chunks by page."""
+    parsed_url = urlparse(url)
+    return urlunparse((
+        parsed_url.scheme,
+        parsed_url.netloc,
+        parsed_url.path.rstrip('/') or '/',
+        parsed_url.params,
+        parsed_url.query,
+        parsed_url.fragment
+    ))
+
+@functools.lru_cache(maxsize=4096)
+def _derive_title(page_url: str, raw_title: str = "No title") -> str:
+    """Crawled page title, or one derived from the URL's last path segment when the page has none."""
+    if raw_title != "No title" and raw_title.strip():
+        return raw_title
+    parsed_url = urlparse(page_url)
+    if parsed_url.path and parsed_url.path != '/':
+        path_parts = [part for part in parsed_url.path.split('/') if part]
+        if path_parts:
+            return path_parts[-1].replace('-', ' ').replace('_', ' ').title()
+        return f"Page from {parsed_url.netloc}"
+    return f"Homepage - {parsed_url.netloc}"
+
+def _build_sources(hits, link_normalized: bool = False) -> list[dict]:
+    """
+    One source entry per crawled page among the hits, counting how many of its chunks matched.
+    Pages are keyed by normalized URL; link_normalized links to that form instead of the first hit's URL.
+    """
+    sources = {}  # normalized URL -> source entry, built in place as hits are counted
+    for hit in hits:
+        page_url = hit.payload["url"]
+        normalized_url = _normalize_url(page_url)
+        source = sources.get(normalized_url)
+        if source is None:
+            page_title = hit.payload.get("title", page_url)
+            link = normalized_url if link_normalized else page_url
+            source = sources[normalized_url] = {
+                "title": page_title if page_title != "No title" else f"Page from {urlparse(page_url).netloc}",
+                "file": link,
+                "page": 1,
+                "link": link,
+                "description": "",
+                "source_type": "web_crawled_chunked",
+                "chunks_found": 0,
+                "total_chunks": hit.payload.get("total_chunks", 1)
+            }
+        source["chunks_found"] += 1
+
+    for source in sources.values():
+        source["description"] = f"Content from {source['chunks_found']}/{source['total_chunks']} chunks of this page"
+    return list(sources.values())
+
+# Brand name to URL mapping
+_BRAND_URLS = {
+    "apple": "https://www.apple.com",
+    "microsoft": "https://www.microsoft.com",
+    "google": "https://www.google.com",
+    "amazon": "https://www.amazon.com",
+    "meta": "https://www.meta.com",
+    "facebook": "https://www.facebook.com",
+    "netflix": "https://www.netflix.com",
+    "spotify": "https://www.spotify.com",
+    "nvidia": "https://www.nvidia.com",
+    "intel": "https://www.intel.com",
+    "amd": "https://www.amd.com",
+    "tesla": "https://www.tesla.com",
+    "openai": "https://www.openai.com",
+    "anthropic": "https://www.anthropic.com",
+    "github": "https://www.github.com",
+    "stackoverflow": "https://www.stackoverflow.com",
+    "reddit": "https://www.reddit.com",
+    "youtube": "https://www.youtube.com",
+    "twitter": "https://www.twitter.com",
+    "x": "https://www.x.com",
+    "linkedin": "https://www.linkedin.com",
+    "instagram": "https://www.instagram.com",
+    "tiktok": "https://www.tiktok.com",
+    "discord": "https://www.discord.com",
+    "slack": "https://www.slack.com",
+    "zoom": "https://www.zoom.us",
+    "salesforce": "https://www.salesforce.com",
+    "oracle": "https://www.oracle.com",
+    "ibm": "https://www.ibm.com",
+    "adobe": "https://www.adobe.com",
+    "dropbox": "https://www.dropbox.com",
+    "airbnb": "https://www.airbnb.com",
+    "uber": "https://www.uber.com",
+    "lyft": "https://www.lyft.com",
+    "paypal": "https://www.paypal.com",
+    "stripe": "https://www.stripe.com",
+    "shopify": "https://www.shopify.com",
+    "wordpress": "https://www.wordpress.com",
+    "squarespace": "https://www.squarespace.com",
+    "wix": "https://www.wix.com"
+}
+# Exact-match lookup table: brand names plus their ".com" domains
+_BRAND_ALIASES = {alias: url for brand, url in _BRAND_URLS.items() for alias in (brand, brand + ".com")}
+
 def resolve_brand_to_url(brand_input: str) -> str:
     """
     Convert brand names to their official website URLs.
@@ -126,59 +561,16 @@ def resolve_brand_to_url(brand_input: str) -> str:
     if brand_input.startswith(("http://", "https://", "www.")):
         return ensure_url_has_scheme(brand_input)
     
-    # Brand name to URL mapping
-    brand_urls = {
-        "apple": "https://www.apple.com",
-        "microsoft": "https://www.microsoft.com",
-        "google": "https://www.google.com",
-        "amazon": "https://www.amazon.com",
-        "meta": "https://www.meta.com",
-        "facebook": "https://www.facebook.com",
-        "netflix": "https://www.netflix.com",
-        "spotify": "https://www.spotify.com",
-        "nvidia": "https://www.nvidia.com",
-        "intel": "https://www.intel.com",
-        "amd": "https://www.amd.com",
-        "tesla": "https://www.tesla.com",
-        "openai": "https://www.openai.com",
-        "anthropic": "https://www.anthropic.com",
-        "github": "https://www.github.com",
-        "stackoverflow": "https://www.stackoverflow.com",
-        "reddit": "https://www.reddit.com",
-        "youtube": "https://www.youtube.com",
-        "twitter": "https://www.twitter.com",
-        "x": "https://www.x.com",
-        "linkedin": "https://www.linkedin.com",
-        "instagram": "https://www.instagram.com",
-        "tiktok": "https://www.tiktok.com",
-        "discord": "https://www.discord.com",
-        "slack": "https://www.slack.com",
-        "zoom": "https://www.zoom.us",
-        "salesforce": "https://www.salesforce.com",
-        "oracle": "https://www.oracle.com",
-        "ibm": "https://www.ibm.com",
-        "adobe": "https://www.adobe.com",
-        "dropbox": "https://www.dropbox.com",
-        "airbnb": "https://www.airbnb.com",
-        "uber": "https://www.uber.com",
-        "lyft": "https://www.lyft.com",
-        "paypal": "https://www.paypal.com",
-        "stripe": "https://www.stripe.com",
-        "shopify": "https://www.shopify.com",
-        "wordpress": "https://www.wordpress.com",
-        "squarespace": "https://www.squarespace.com",
-        "wix": "https://www.wix.com"
-    }
-    
     # Normalize input (lowercase, strip spaces)
     normalized_input = brand_input.lower().strip()
     
-    # Check for exact match
-    if normalized_input in brand_urls:
-        return brand_urls[normalized_input]
+    # Check for exact match, including the bare "<brand>.com" domain
+    url = _BRAND_ALIASES.get(normalized_input)
+    if url:
+        return url
     
-    # Check for partial matches (e.g., "apple.com" -> "apple")
-    for brand, url in brand_urls.items():
+    # Check for partial matches (e.g., "apple store" -> "apple")
+    for brand, url in _BRAND_URLS.items():
         if brand in normalized_input or normalized_input in brand:
             return url
     
@@ -192,63 +584,12 @@ def ensure_qdrant_collection(name: str):
         logger.info(f"[Qdrant] Creating collection {name}")
         client.recreate_collection(
             collection_name=name,
-            vectors_config=VectorParams(size=model.get_sentence_embedding_dimension(), distance=Distance.COSINE)
+            # Embeddings are L2-normalized at encode time, so a dot product equals cosine without the per-vector norms
+            vectors_config=VectorParams(size=model.get_sentence_embedding_dimension(), distance=Distance.DOT),
+            hnsw_config=RAG_HNSW_CONFIG,
+            quantization_config=RAG_QUANTIZATION_CONFIG
         )
 
-
-
-# --- Qdrant Upsert Helper for Crawled Pages ---
-def upsert_crawled_pages_to_qdrant(pages: list[dict], collection_name: str, batch_size: int = 50):
-    """
-    Upserts crawled page documents into a Qdrant collection for embedding search.
-
-    Args:
-        pages (list[dict]): List of page documents with keys: url, title, content, metadata.
-        collection_name (str): The Qdrant collection name.
-        batch_size (int): Number of points to upsert per batch.
-
-    Returns:
-        int: Total number of points upserted.
-    """
-    if not pages:
-        logger.warning("[Qdrant] No pages to upsert.")
-        return 0
-
-    # Ensure collection exists
-    ensure_qdrant_collection(collection_name)
-
-    total_upserts = 0
-    batch = []
-
-    for i, page in enumerate(pages, start=1):
-        content = page.get("content", "")
-        if not content:
-            continue
-        embedding = model.encode(content).tolist()
-        point = PointStruct(
-            id=hashlib.md5((ensure_url_has_scheme(page.get("url", "")) + content[:200]).encode()).hexdigest(),
-            vector=embedding,
-            payload={
-                "text": content,
-                "url": ensure_url_has_scheme(page.get("url", "")),
-                "title": page.get("title", ""),
-                "metadata": page.get("metadata", {})
-            }
-        )
-        batch.append(point)
-
-        if len(batch) >= batch_size:
-            client.upsert(collection_name=collection_name, points=batch)
-            total_upserts += len(batch)
-            batch = []
-
-    if batch:
-        client.upsert(collection_name=collection_name, points=batch)
-        total_upserts += len(batch)
-
-    logger.info(f"[Qdrant] Upserted {total_upserts} pages into collection '{collection_name}'.")
-    return total_upserts
-
 def extract_relevant_sections(content: str, query: str, max_sections: int = 3):
     """Extract relevant sections from content based on the query."""
     if not content or not query:
@@ -256,97 +597,119 @@ def extract_relevant_sections(content: str, query: str, max_sections: int = 3):
     
     # Split content into sections (paragraphs, headings, etc.)
     sections = []
+    query_words = set(query.lower().split())
     
     # Split by double newlines (paragraphs)
     paragraphs = content.split('\n\n')
     
     # Also split by headings (lines starting with #)
     for paragraph in paragraphs:
-        if paragraph.strip():
-            # Check if this section is relevant to the query
-            relevance_score = calculate_relevance(paragraph, query)
-            if relevance_score > 0.3:  # Threshold for relevance
-                sections.append({
-                    "text": paragraph.strip()[:500] + "..." if len(paragraph.strip()) > 500 else paragraph.strip(),
-                    "relevance_score": relevance_score,
-                    "section_type": "paragraph"
-                })
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        paragraph_words = set(paragraph.lower().split())
+        # Most paragraphs share no word with the query; skip them before any scoring
+        if query_words.isdisjoint(paragraph_words):
+            continue
+        # Check if this section is relevant to the query
+        relevance_score = _relevance(paragraph_words, query_words)
+        if relevance_score > 0.3:  # Threshold for relevance
+            sections.append({
+                "text": paragraph[:500] + "..." if len(paragraph) > 500 else paragraph,
+                "relevance_score": relevance_score,
+                "section_type": "paragraph"
+            })
     
     # Sort by relevance and return top sections
     sections.sort(key=lambda x: x['relevance_score'], reverse=True)
     return sections[:max_sections]
 
+def _relevance(text_words: set, query_words: set) -> float:
+    """Fraction of the query words that occur as words in the text."""
+    if not query_words:
+        return 0
+    return len(text_words & query_words) / len(query_words)
+
 def calculate_relevance(text: str, query: str):
     """Calculate relevance score between text and query."""
     if not text or not query:
         return 0
-    
-    text_lower = text.lower()
-    query_lower = query.lower()
-    
-    # Split query into words
-    query_words = query_lower.split()
-    
-    # Count word matches
-    matches = 0
-    for word in query_words:
-        if word in text_lower:
-            matches += 1
-    
-    # Calculate relevance score
-    if len(query_words) == 0:
-        return 0
-    
-    return matches / len(query_words)
+    return _relevance(set(text.lower().split()), set(query.lower().split()))
 
 
 
         
 
+try:
+    import lxml # C parser for BeautifulSoup, much faster than html.parser
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+_WS_RE = re.compile(r'\s+')
+
+# Pages are cut off at this size before parsing; only the first few thousand characters of text are used
+SCRAPE_MAX_BYTES = 512 * 1024
+SCRAPE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+def _parse_html(content: bytes) -> BeautifulSoup:
+    """Parses a page (with lxml when installed) and drops script and style elements."""
+    soup = BeautifulSoup(content, HTML_PARSER)
+    for script in soup(["script", "style"]):
+        script.decompose()
+    return soup
+
+def _page_text(soup: BeautifulSoup) -> str:
+    """Visible text of a parsed page, with whitespace runs collapsed in a single pass."""
+    return _WS_RE.sub(' ', soup.get_text(separator=' ')).strip()
+
+def _scraped_page_result(content: bytes, url: str) -> dict:
+    """Title and cleaned, length-limited text of a downloaded HTML page."""
+    soup = _parse_html(content)
+    text = _page_text(soup)
+    
+    # Get title
+    title = soup.find('title')
+    title_text = title.get_text().strip() if title else url
+    
+    # Limit text length to avoid token limits
+    if len(text) > 3000:
+        text = text[:3000] + "..."
+    
+    return {
+        "title": title_text,
+        "snippet": text,
+        "link": url
+    }
+
+def _fetch_page(url: str, headers: dict = SCRAPE_HEADERS) -> bytes:
+    """Downloads at most SCRAPE_MAX_BYTES of a page; anything beyond is never transferred or parsed."""
+    with http_client.stream("GET", url, headers=headers, timeout=10, follow_redirects=True) as response:
+        response.raise_for_status()
+        chunks = []
+        size = 0
+        for chunk in response.iter_bytes():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= SCRAPE_MAX_BYTES:
+                break
+        return b"".join(chunks)[:SCRAPE_MAX_BYTES]
+
+def _scrape_error_result(url: str, e: Exception) -> dict:
+    logger.error(f"[WebsiteScraping] Failed to scrape {url}: {e}")
+    return {
+        "title": f"Error scraping {url}",
+        "snippet": f"Failed to scrape website: {str(e)}",
+        "link": url
+    }
+
 def scrape_website_fallback(url: str, query: str):
     """Fallback scraping method using BeautifulSoup."""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-        
-        # Get text content
-        text = soup.get_text()
-        
-        # Clean up text
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
-        
-        # Get title
-        title = soup.find('title')
-        title_text = title.get_text().strip() if title else url
-        
-        # Limit text length to avoid token limits
-        if len(text) > 3000:
-            text = text[:3000] + "..."
-        
-        return {
-            "title": title_text,
-            "snippet": text,
-            "link": url
-        }
+        return _scraped_page_result(_fetch_page(url), url)
     except Exception as e:
-        logger.error(f"[WebsiteScraping] Failed to scrape {url}: {e}")
-        return {
-            "title": f"Error scraping {url}",
-            "snippet": f"Failed to scrape website: {str(e)}",
-            "link": url
-        }
-
+        return _scrape_error_result(url, e)
 
 def qa_prompt_template(context: str, query: str, response_size: str, response_type: str, file_names: list[str] = None) -> str:
     response_instructions = {
@@ -393,7 +756,6 @@ Your response must be in strict JSON format. The answer should be provided under
 
 def answer_question_with_rag(query: str, collection_name: str, response_size: str = "short", response_type: str = "sentence", top_k=3, compare_chatgpt: bool = False, share_data_with_chatgpt: bool = False, use_web: bool = False, specific_url: str = ""):
     start_func_time = time.time()
-    vector = model.encode(query).tolist()
 
     if use_web:
         if specific_url and specific_url.strip():
@@ -427,56 +789,12 @@ def answer_question_with_rag(query: str, collection_name: str, response_size: st
                     if collection_exists:
                         logger.info(f"[RAG] Using existing crawled content from collection '{collection_name_web}'")
                         # Perform semantic search on existing content
-                        query_vector = model.encode(query).tolist()
-                        hits = client.search(collection_name=collection_name_web, query_vector=query_vector, limit=top_k)
+                        hits = _search_cached(collection_name_web, query, top_k)
                         context = "\n---\n".join([hit.payload["text"] for hit in hits])
                         
                         # Create sources from existing content
-                        sources = []
-                        crawled_pages = {}  # Track unique pages
-                        
-                        for hit in hits:
-                            page_url = hit.payload["url"]
-                            page_title = hit.payload.get("title", page_url)
-                            chunk_index = hit.payload.get("chunk_index", 0)
-                            total_chunks = hit.payload.get("total_chunks", 1)
-                            
-                            # Normalize URL to avoid duplicates
-                            from urllib.parse import urlparse, urlunparse
-                            parsed_url = urlparse(page_url)
-                            normalized_url = urlunparse((
-                                parsed_url.scheme,
-                                parsed_url.netloc,
-                                parsed_url.path.rstrip('/') or '/',
-                                parsed_url.params,
-                                parsed_url.query,
-                                parsed_url.fragment
-                            ))
-                            
-                            # Track unique pages
-                            if normalized_url not in crawled_pages:
-                                crawled_pages[normalized_url] = {
-                                    "title": page_title if page_title != "No title" else f"Page from {parsed_url.netloc}",
-                                    "url": page_url,
-                                    "chunks_found": 0,
-                                    "total_chunks": total_chunks
-                                }
-                            crawled_pages[normalized_url]["chunks_found"] += 1
-                        
-                        # Convert to sources format
-                        for page_url, page_info in crawled_pages.items():
-                            source = {
-                                "title": page_info["title"],
-                                "file": page_info["url"],
-                                "page": 1,
-                                "link": page_info["url"],
-                                "description": f"Content from {page_info['chunks_found']}/{page_info['total_chunks']} chunks of this page",
-                                "source_type": "web_crawled_chunked",
-                                "chunks_found": page_info["chunks_found"],
-                                "total_chunks": page_info["total_chunks"]
-                            }
-                            sources.append(source)
-                            logger.info(f"[RAG] Created source for existing crawled page: {page_info['url']}")
+                        sources = _build_sources(hits)
+                        logger.info(f"[RAG] Created {len(sources)} sources for existing crawled pages")
                         
                         # Build RAG prompt with existing content
                         prompt = f"""
@@ -518,24 +836,11 @@ def answer_question_with_rag(query: str, collection_name: str, response_size: st
                     logger.error(f"[RAG] Crawl4AI failed: {e}. Using simple requests fallback.")
                     # Fallback to simple requests + BeautifulSoup
                     try:
-                        import requests
-                        from bs4 import BeautifulSoup
-                        
-                        response = requests.get(resolved_url, timeout=10, headers={
+                        content = _fetch_page(resolved_url, headers={
                             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                         })
-                        response.raise_for_status()
-                        
-                        soup = BeautifulSoup(response.content, 'html.parser')
-                        # Remove script and style elements
-                        for script in soup(["script", "style"]):
-                            script.decompose()
                         
-                        text = soup.get_text()
-                        # Clean up text
-                        lines = (line.strip() for line in text.splitlines())
-                        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                        text = ' '.join(chunk for chunk in chunks if chunk)
+                        text = _page_text(_parse_html(content))
                         
                         # Limit text length
                         if len(text) > 4000:
@@ -568,24 +873,11 @@ def answer_question_with_rag(query: str, collection_name: str, response_size: st
                 logger.warning("[RAG] Crawl4AI not available. Using simple requests fallback.")
                 # Fallback to simple requests + BeautifulSoup
                 try:
-                    import requests
-                    from bs4 import BeautifulSoup
-                    
-                    response = requests.get(resolved_url, timeout=10, headers={
+                    content = _fetch_page(resolved_url, headers={
                         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                     })
-                    response.raise_for_status()
                     
-                    soup = BeautifulSoup(response.content, 'html.parser')
-                    # Remove script and style elements
-                    for script in soup(["script", "style"]):
-                        script.decompose()
-                    
-                    text = soup.get_text()
-                    # Clean up text
-                    lines = (line.strip() for line in text.splitlines())
-                    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-                    text = ' '.join(chunk for chunk in chunks if chunk)
+                    text = _page_text(_parse_html(content))
                     
                     # Limit text length
                     if len(text) > 4000:
@@ -636,56 +928,12 @@ def answer_question_with_rag(query: str, collection_name: str, response_size: st
             if collection_exists:
                 # Use existing crawled content
                 logger.info(f"[RAG] Using existing crawled content from collection '{collection_name_web}'")
-                query_vector = model.encode(query).tolist()
-                hits = client.search(collection_name=collection_name_web, query_vector=query_vector, limit=top_k)
+                hits = _search_cached(collection_name_web, query, top_k)
                 context = "\n---\n".join([hit.payload["text"] for hit in hits])
                 
                 # Create sources from existing content
-                sources = []
-                crawled_pages = {}  # Track unique pages
-                
-                for hit in hits:
-                    page_url = hit.payload["url"]
-                    page_title = hit.payload.get("title", page_url)
-                    chunk_index = hit.payload.get("chunk_index", 0)
-                    total_chunks = hit.payload.get("total_chunks", 1)
-                    
-                    # Normalize URL to avoid duplicates
-                    from urllib.parse import urlparse, urlunparse
-                    parsed_url = urlparse(page_url)
-                    normalized_url = urlunparse((
-                        parsed_url.scheme,
-                        parsed_url.netloc,
-                        parsed_url.path.rstrip('/') or '/',
-                        parsed_url.params,
-                        parsed_url.query,
-                        parsed_url.fragment
-                    ))
-                    
-                    # Track unique pages
-                    if normalized_url not in crawled_pages:
-                        crawled_pages[normalized_url] = {
-                            "title": page_title if page_title != "No title" else f"Page from {parsed_url.netloc}",
-                            "url": page_url,
-                            "chunks_found": 0,
-                            "total_chunks": total_chunks
-                        }
-                    crawled_pages[normalized_url]["chunks_found"] += 1
-                
-                # Convert to sources format
-                for page_url, page_info in crawled_pages.items():
-                    source = {
-                        "title": page_info["title"],
-                        "file": page_info["url"],
-                        "page": 1,
-                        "link": page_info["url"],
-                        "description": f"Content from {page_info['chunks_found']}/{page_info['total_chunks']} chunks of this page",
-                        "source_type": "web_crawled_chunked",
-                        "chunks_found": page_info["chunks_found"],
-                        "total_chunks": page_info["total_chunks"]
-                    }
-                    sources.append(source)
-                    logger.info(f"[RAG] Created source for existing crawled page: {page_info['url']}")
+                sources = _build_sources(hits)
+                logger.info(f"[RAG] Created {len(sources)} sources for existing crawled pages")
                 
                 documents = [(hit.payload["text"], hit.payload.get("url",""), 1) for hit in hits]
                 file_names = [hit.payload.get("url","") for hit in hits]
@@ -703,10 +951,10 @@ def answer_question_with_rag(query: str, collection_name: str, response_size: st
                 }]
     else:
         # Your existing Qdrant-based retrieval
-        hits = client.search(collection_name=collection_name, query_vector=model.encode(query).tolist(), limit=top_k)
+        hits = _search_cached(collection_name, query, top_k)
         documents = [(hit.payload["text"], hit.payload.get("source_file", ""), hit.payload.get("page", 1)) for hit in hits]
         context = "\n---\n".join([doc[0] for doc in documents])
-        file_names = list({hit.payload.get("source_file", "") for hit in client.scroll(collection_name=collection_name, limit=10000)[0] if hit.payload.get("source_file", "")})
+        file_names = _collection_file_names(collection_name)
     # This prompt includes context and is used for Allyin (OpenRouter)
     allyin_prompt = qa_prompt_template(context, query, response_size, response_type, file_names)
     logger.info(f"[RAG] Allyin prompt length: {len(allyin_prompt)} characters.")
@@ -717,17 +965,16 @@ def answer_question_with_rag(query: str, collection_name: str, response_size: st
     openrouter_time = 0.0
     chatgpt_time = 0.0
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_openrouter = executor.submit(call_openrouter, allyin_prompt)
-        if compare_chatgpt:
-            # Conditionally set prompt for ChatGPT: full context or just the query
-            if share_data_with_chatgpt:
-                chatgpt_prompt_content = allyin_prompt
-                logger.info(f"[RAG] ChatGPT will receive full RAG context.")
-            else:
-                # When share_data_with_chatgpt is False, only send the raw query to ChatGPT,
-                # formatted to still ask for JSON output.
-                chatgpt_prompt_content = f"""
+    future_openrouter = _submit_llm("qa", call_openrouter, allyin_prompt)
+    if compare_chatgpt:
+        # Conditionally set prompt for ChatGPT: full context or just the query
+        if share_data_with_chatgpt:
+            chatgpt_prompt_content = allyin_prompt
+            logger.info(f"[RAG] ChatGPT will receive full RAG context.")
+        else:
+            # When share_data_with_chatgpt is False, only send the raw query to ChatGPT,
+            # formatted to still ask for JSON output.
+            chatgpt_prompt_content = f"""
 You are a helpful assistant. Strictly output only the JSON object.
 Do not include any extra commentary, no introduction, no explanation, no closing statement.
 Your reply MUST start with '{{' and end with '}}'.
@@ -739,33 +986,30 @@ Question:
 
 Answer:
 """
-                logger.info(f"[RAG] ChatGPT will receive ONLY the query (no RAG context): {query[:100]}...")
+            logger.info(f"[RAG] ChatGPT will receive ONLY the query (no RAG context): {query[:100]}...")
 
 
-            future_chatgpt = executor.submit(call_chatgpt, chatgpt_prompt_content)
-        else:
-            future_chatgpt = None # Don't submit if not comparing
+        future_chatgpt = _submit_llm("qa", call_chatgpt, chatgpt_prompt_content)
+    else:
+        future_chatgpt = None # Don't submit if not comparing
 
-        reply, openrouter_time = future_openrouter.result()
-        if future_chatgpt: # Only get result if submitted
-            reply_chatgpt_raw, chatgpt_time = future_chatgpt.result()
-        else:
-            chatgpt_time = 0.0
+    reply, openrouter_time = _hedged_result(future_openrouter, "qa", call_openrouter, allyin_prompt)
+    if future_chatgpt: # Only get result if submitted
+        reply_chatgpt_raw, chatgpt_time = _hedged_result(future_chatgpt, "qa", call_chatgpt, chatgpt_prompt_content)
+    else:
+        chatgpt_time = 0.0
 
     try:
-        parsed_openrouter = json.loads(reply)
+        parsed_openrouter = _json_loads(reply)
         openrouter_answer = parsed_openrouter.get("answer", reply)
     except (json.JSONDecodeError, IndexError):
         openrouter_answer = reply
 
     if compare_chatgpt and reply_chatgpt_raw:
-        chatgpt_clean_raw = reply_chatgpt_raw.strip()
-        if chatgpt_clean_raw.startswith("```"):
-            chatgpt_clean_raw = re.sub(r"^```(?:json)?\s*", "", chatgpt_clean_raw, flags=re.IGNORECASE)
-            chatgpt_clean_raw = re.sub(r"\s*```$", "", chatgpt_clean_raw)
+        chatgpt_clean_raw = _strip_fence(reply_chatgpt_raw)
 
         try:
-            parsed_chatgpt = json.loads(chatgpt_clean_raw)
+            parsed_chatgpt = _json_loads(chatgpt_clean_raw)
             if parsed_chatgpt == {}:
                 chatgpt_answer = "Information not available"
             else:
@@ -806,6 +1050,19 @@ Answer:
     }, sources
 
 
+SCORE_CONTRACT_MAX_TOKENS = 2000 # about the 8000 characters each contract was previously cut to
+SCORE_CONTRACTS_TOKEN_BUDGET = 60000 # all contract texts in one scoring prompt
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens cl100k_base tokens, on a token boundary (~4 characters per token without tiktoken)."""
+    if _TOKEN_ENCODING is None:
+        return text[:max_tokens * 4]
+    # Tokens rarely span more than a few characters, so encoding a bounded prefix is enough
+    token_ids = _TOKEN_ENCODING.encode(text[:max_tokens * 16], disallowed_special=())
+    if len(token_ids) <= max_tokens:
+        return text[:max_tokens * 16]
+    return _TOKEN_ENCODING.decode(token_ids[:max_tokens])
+
 def criteria_prompt_template(criterion: str, contract_texts: dict, user_criterion_prompt: str, score_label: str) -> str:
     prompt = f"""
 You are an expert contract evaluation assistant. You are provided with multiple contracts and criteria list. Evaluate each contract independently based on the multiple evaluation criteria. Do NOT miss any criteria. For each contract along with the criteria, output its serial, name, a score from 1 to {score_label} (higher is better), and a brief rationale. Stricly score out of {score_label}
@@ -819,9 +1076,10 @@ You have to score for ALL sub categories provided in {criterion} list. DO NOT ma
 
 ### Contracts:
 """
-    for name, text in contract_texts.items():
-        prompt += f"\n=== Contract: {name} ===\n{text}\n"
-    prompt += """
+    # Build the contract sections as parts and join once, instead of re-copying the growing prompt per contract
+    parts = [prompt]
+    parts.extend(f"\n=== Contract: {name} ===\n{text}\n" for name, text in contract_texts.items())
+    parts.append("""
 
 Your response must be in strict JSON format like:
 {{
@@ -830,8 +1088,16 @@ Your response must be in strict JSON format like:
     {{"Serial": "1b","name": "Contract_B", "criteria" : "Technical Specifications of the Proposed Approach","score": {score_label},  "weight":0.2, "rationale": "..."}}
   ]
 }}
-"""
-    return prompt
+""")
+    return "".join(parts)
+
+def _entry_float(entry: dict, key: str) -> float:
+    try:
+        # Handle cases where the value might be a string (e.g., "0.1") or None
+        return float(entry.get(key, 0))
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid {key} value encountered: {entry.get(key)}. Defaulting to 0.")
+        return 0.0 # Default to 0 if the value is not a valid number
 
 def compute_weighted_scores(flat_contracts: list, max_score: int = 5) -> dict:
     """
@@ -839,71 +1105,65 @@ def compute_weighted_scores(flat_contracts: list, max_score: int = 5) -> dict:
     Each entry is expected to have 'name', 'score', and 'weight'.
     Returns a dictionary of contract names to their final weighted scores and percentages.
     """
-    scores = collections.defaultdict(lambda: {"weighted_sum": 0.0, "total_weight": 0.0})
-    
     score_key = f"score_out_of_{max_score * 10}" # Re-define for use in this function's output
+    if not flat_contracts:
+        return {}
+
+    # Contract index per entry, numbered in order of first appearance
+    contract_index = {}
+    inverse = np.fromiter(
+        (contract_index.setdefault(str(entry.get("name", "")).replace(".pdf", "").replace("contracts/", "").strip(), len(contract_index))
+         for entry in flat_contracts),
+        dtype=np.intp, count=len(flat_contracts)
+    )
+    scores = np.fromiter((_entry_float(entry, "score") for entry in flat_contracts), dtype=np.float64, count=len(flat_contracts))
+    weights = np.fromiter((_entry_float(entry, "weight") for entry in flat_contracts), dtype=np.float64, count=len(flat_contracts))
 
-    for entry in flat_contracts:
-        name = str(entry.get("name", "")).replace(".pdf", "").replace("contracts/", "").strip()
-        
-        try:
-            score = float(entry.get("score", 0))
-        except (ValueError, TypeError):
-            score = 0.0 # Default to 0 if score is not a valid number
-            logger.warning(f"Invalid score value encountered: {entry.get('score')}. Defaulting to 0.")
-
-        try:
-            # Handle cases where weight might be a string (e.g., "0.1") or None
-            weight = float(entry.get("weight", 0))
-        except (ValueError, TypeError):
-            weight = 0.0 # Default to 0 if weight is not a valid number
-            logger.warning(f"Invalid weight value encountered: {entry.get('weight')}. Defaulting to 0.")
-
-        scores[name]["weighted_sum"] += score * weight
-        scores[name]["total_weight"] += weight
+    # Per-contract sums in one vectorized pass
+    weighted_sums = np.bincount(inverse, weights=scores * weights, minlength=len(contract_index))
+    total_weights = np.bincount(inverse, weights=weights, minlength=len(contract_index))
+    # Contracts whose weights sum to zero score 0
+    raw_scores = np.divide(weighted_sums, total_weights, out=np.zeros_like(weighted_sums), where=total_weights > 0)
 
     final_scores = {}
-    for name, vals in scores.items():
-        total = vals["total_weight"]
-        if total > 0:
-            raw_score = (vals["weighted_sum"] / total)
-            percentage = (raw_score / max_score) * 100
-        else:
-            raw_score = 0.0
-            percentage = 0.0 # Or handle as N/A if weights sum to zero
-
+    for name, raw_score in zip(contract_index, raw_scores.tolist()):
         final_scores[name] = {
             score_key: round(raw_score * (max_score * 10 / max_score), 2), # Scale back to out of 100 or 50 as needed
-            "percentage": round(percentage, 2)
+            "percentage": round((raw_score / max_score) * 100, 2)
         }
     return final_scores
 
-
 def score_contracts(user_criterion_prompt: str, collection_name: str, max_score: int = 5, compare_chatgpt: bool = False, share_data_with_chatgpt: bool = False) -> dict: # Added share_data_with_chatgpt
-    # Retrieve all documents for the collection
-    all_hits, _ = client.scroll(collection_name=collection_name, limit=10000)
-    doc_names = list(set(hit.payload.get("source_file", "unknown") for hit in all_hits))
+    # Retrieve all chunks for the collection in one paginated scroll and group them by file locally,
+    # instead of a filtered scroll per file
+    all_hits = []
+    offset = None
+    while True:
+        hits, offset = client.scroll(
+            collection_name=collection_name,
+            limit=10_000,
+            offset=offset,
+            with_payload=["text", "source_file"],
+            with_vectors=False,
+        )
+        all_hits.extend(hits)
+        if offset is None:
+            break
+    all_hits.sort(key=lambda h: (h.payload.get("source_file", "unknown"), h.id))
     contract_texts = {}
 
-    import time
     start_time = time.time()
 
     # Define score_key for dynamic score key naming, using base-10 scale
     score_key = f"score_out_of_{max_score * 10}"
 
 
-    for name in doc_names:
-        hits, _ = client.scroll(
-            collection_name=collection_name,
-            scroll_filter=Filter(
-                must=[FieldCondition(key="source_file", match=MatchValue(value=name))]
-            ),
-            limit=10_000,
-        )
-        hits.sort(key=lambda h: h.id)
-        full_text = "\n".join(h.payload["text"] for h in hits)
-        full_text = full_text[:8000]  # Truncate to avoid API limits
-        contract_texts[name.replace(".pdf", "").replace("contracts/", "").strip()] = full_text
+    for name, hits in itertools.groupby(all_hits, key=lambda h: h.payload.get("source_file", "unknown")):
+        contract_texts[name.replace(".pdf", "").replace("contracts/", "").strip()] = "\n".join(h.payload["text"] for h in hits)
+    # Truncate to avoid API limits: the prompt's contract budget is shared evenly across contracts
+    if contract_texts:
+        tokens_per_contract = min(SCORE_CONTRACT_MAX_TOKENS, SCORE_CONTRACTS_TOKEN_BUDGET // len(contract_texts))
+        contract_texts = {name: _truncate_tokens(text, tokens_per_contract) for name, text in contract_texts.items()}
 
     # Append additional context from parsed_criteria.jsonl if available
     criteria_path = Path(__file__).resolve().parent.parent.parent / "data" / collection_name.replace("contract_docs_", "") / "parsed_criteria.jsonl"
@@ -925,43 +1185,39 @@ def score_contracts(user_criterion_prompt: str, collection_name: str, max_score:
     # Decide if we will actually run ChatGPT and share context
     run_chatgpt = compare_chatgpt and share_data_with_chatgpt
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_openrouter = executor.submit(call_openrouter, openrouter_scoring_prompt)
-        if run_chatgpt:
-            # ChatGPT will receive full scoring context because share_data_with_chatgpt=True
-            chatgpt_scoring_prompt_content = openrouter_scoring_prompt
-            logger.info(f"[RAG-Score] ChatGPT will receive full scoring context.")
-            future_chatgpt = executor.submit(call_chatgpt, chatgpt_scoring_prompt_content)
-        else:
-            logger.info("[RAG-Score] ChatGPT call skipped (share_data_with_chatgpt=False). Will return 'Information not available'.")
-            future_chatgpt = None
+    future_openrouter = _submit_llm("scoring", call_openrouter, openrouter_scoring_prompt)
+    if run_chatgpt:
+        # ChatGPT will receive full scoring context because share_data_with_chatgpt=True
+        chatgpt_scoring_prompt_content = openrouter_scoring_prompt
+        logger.info(f"[RAG-Score] ChatGPT will receive full scoring context.")
+        future_chatgpt = _submit_llm("scoring", call_chatgpt, chatgpt_scoring_prompt_content)
+    else:
+        logger.info("[RAG-Score] ChatGPT call skipped (share_data_with_chatgpt=False). Will return 'Information not available'.")
+        future_chatgpt = None
 
-        openrouter_answer_raw, openrouter_time = future_openrouter.result()
-        if future_chatgpt:
-            chatgpt_answer_raw, chatgpt_time = future_chatgpt.result()
-        else:
-            chatgpt_time = 0.0
-            # Force a deterministic JSON so downstream parsing works
-            chatgpt_answer_raw = '{"contracts": [], "answer": "Information not available"}'
+    openrouter_answer_raw, openrouter_time = _hedged_result(future_openrouter, "scoring", call_openrouter, openrouter_scoring_prompt)
+    if future_chatgpt:
+        chatgpt_answer_raw, chatgpt_time = _hedged_result(future_chatgpt, "scoring", call_chatgpt, chatgpt_scoring_prompt_content)
+    else:
+        chatgpt_time = 0.0
+        # Force a deterministic JSON so downstream parsing works
+        chatgpt_answer_raw = '{"contracts": [], "answer": "Information not available"}'
 
     # Initialize parsed answers to empty dictionaries
     parsed_openrouter_answer = {}
     parsed_chatgpt_answer = {}
 
     try:
-        parsed_openrouter_answer = json.loads(openrouter_answer_raw)
+        parsed_openrouter_answer = _json_loads(openrouter_answer_raw)
     except json.JSONDecodeError:
         logger.error(f"[RAG-Score] OpenRouter response not valid JSON. Raw: {openrouter_answer_raw[:200]}...")
         parsed_openrouter_answer = {"error": "Invalid JSON from OpenRouter", "raw_response": openrouter_answer_raw}
 
     if compare_chatgpt and chatgpt_answer_raw:
-        chatgpt_clean_raw = chatgpt_answer_raw.strip()
-        if chatgpt_clean_raw.startswith("```"):
-            chatgpt_clean_raw = re.sub(r"^```(?:json)?\s*", "", chatgpt_clean_raw, flags=re.IGNORECASE)
-            chatgpt_clean_raw = re.sub(r"\s*```$", "", chatgpt_clean_raw)
+        chatgpt_clean_raw = _strip_fence(chatgpt_answer_raw)
 
         try:
-            parsed_chatgpt_answer = json.loads(chatgpt_clean_raw)
+            parsed_chatgpt_answer = _json_loads(chatgpt_clean_raw)
         except json.JSONDecodeError:
             logger.warning(f"[RAG-Score] ChatGPT response not perfect JSON. Raw: {chatgpt_clean_raw[:200]}...")
             parsed_chatgpt_answer = {"error": "Invalid JSON from ChatGPT", "raw_response": chatgpt_clean_raw}
@@ -987,12 +1243,13 @@ def score_contracts(user_criterion_prompt: str, collection_name: str, max_score:
 
         best_contract = None
         if score_dict_for_best_selection:
-            # Find the contract with the highest score (using 'score_out_of_X' key)
-            best_contract_item = max(
-                score_dict_for_best_selection.items(),
-                key=lambda x: x[1].get(score_key, 0) # Use score_key for comparison
+            # Find the contract with the highest score (using 'score_out_of_X' key); argmax keeps the first on ties
+            contract_names = list(score_dict_for_best_selection)
+            contract_scores = np.fromiter(
+                (vals.get(score_key, 0) for vals in score_dict_for_best_selection.values()),
+                dtype=np.float64, count=len(contract_names)
             )
-            best_contract = best_contract_item[0]
+            best_contract = contract_names[int(contract_scores.argmax())]
 
         if best_contract:
             # Collect rationales for the best contract from all available raw results
@@ -1020,15 +1277,12 @@ Your output must be in JSON format like:
   ]
 }}
 """
-            summary_response, _ = call_openrouter(summary_prompt)
-            summary_response = summary_response.strip()
-            if summary_response.startswith("```"):
-                summary_response = re.sub(r"^```(?:json)?\s*", "", summary_response, flags=re.IGNORECASE)
-                summary_response = re.sub(r"\s*```$", "", summary_response)
+            summary_response, _ = call_llm_hedged("scoring_summary", call_openrouter, summary_prompt)
+            summary_response = _strip_fence(summary_response)
 
             summary_of_best = {
                 "best_contract": best_contract,
-                "summary": json.loads(summary_response)["summary"]
+                "summary": _json_loads(summary_response)["summary"]
             }
         else:
             summary_of_best = []
@@ -1067,19 +1321,14 @@ First, provide a short justification for each response. Then give your final ver
 """
     try:
         response, _ = call_openrouter(comparison_prompt)
-        response = response.strip()
-        if response.startswith("```"):
-            response = re.sub(r"^```(?:json)?\s*", "", response, flags=re.IGNORECASE)
-            response = re.sub(r"\s*```$", "", response)
-        return json.loads(response)
+        response = _strip_fence(response)
+        return _json_loads(response)
     except Exception as e:
         logger.error(f"[Compare] Error comparing responses: {e}", exc_info=True)
         return {"error": str(e)}
 
 
     # --- Crawl4AI + RAG Answer ---
-import asyncio
-import hashlib
 try:
     from crawl4ai import AsyncWebCrawler, CrawlerRunConfig
     from crawl4ai.deep_crawling import BFSDeepCrawlStrategy
@@ -1090,6 +1339,12 @@ except ImportError:
     AsyncWebCrawler = None
     CRAWL4AI_AVAILABLE = False
 
+CRAWL_PAGE_QUEUE_SIZE = 8 # crawled pages buffered ahead of the embedder
+CRAWL_EMBED_BATCH_PAGES = 8 # waiting pages whose chunks are encoded together
+CRAWL4AI_TIMEOUT_S = 1200 # overall bound on one crawl-and-answer run
+# Timed-out crawls only return partial sources, so paraphrases of a recent query may reuse its hits
+PARTIAL_RESULTS_HIT_THRESHOLD = 0.86
+
 async def crawl4ai_and_answer(url: str, query: str, collection_name: str = "testing", depth: int = 2, max_pages: int = 20, top_k: int = 3):
     """
     Crawl a site using Crawl4AI, store in Qdrant, and answer a query with RAG.
@@ -1106,136 +1361,140 @@ async def crawl4ai_and_answer(url: str, query: str, collection_name: str = "test
             max_pages=max_pages
         ),
         scraping_strategy=LXMLWebScrapingStrategy(),
+        stream=True, # yield pages as they are crawled instead of after the whole crawl
         verbose=True
     )
 
     logger.info(f"[Crawl4AI] Starting crawl of {url} with depth {depth} and max_pages {max_pages}")
     stored_chunks = 0
     stored_pages = 0
-    try:
+    crawled_urls = []
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
+    batch_size = 256 # points per upsert request
+    # Pages flow crawler -> embedder -> upserter. The bounded queues let crawling, encoding and
+    # uploads overlap without any stage running more than a couple of items ahead of the next.
+    page_queue = asyncio.Queue(maxsize=CRAWL_PAGE_QUEUE_SIZE)
+    point_queue = asyncio.Queue(maxsize=2)
+
+    async def crawl_pages():
         async with AsyncWebCrawler() as crawler:
-            results = await crawler.arun(url, config=config)
-            logger.info(f"[Crawl4AI] Crawled {len(results)} pages in total")
-            crawled_urls = []
-            for result in results:
+            async for result in await crawler.arun(url, config=config):
                 page_url = getattr(result, "url", "unknown")
-                page_title = getattr(result, "title", "No title")
+                page_title = _derive_title(page_url, getattr(result, "title", "No title"))
                 page_depth = result.metadata.get('depth', 0)
-                if page_title == "No title" or not page_title.strip():
-                    from urllib.parse import urlparse
-                    parsed_url = urlparse(page_url)
-                    if parsed_url.path and parsed_url.path != '/':
-                        path_parts = [part for part in parsed_url.path.split('/') if part]
-                        if path_parts:
-                            page_title = path_parts[-1].replace('-', ' ').replace('_', ' ').title()
-                        else:
-                            page_title = f"Page from {parsed_url.netloc}"
-                    else:
-                        page_title = f"Homepage - {parsed_url.netloc}"
                 crawled_urls.append(f"{page_title} - {page_url} (Depth: {page_depth})")
-            logger.info(f"[Crawl4AI] Crawled pages: {crawled_urls}")
-            for result in results[:3]:
-                logger.info(f"[Crawl4AI] URL: {result.url}")
-                logger.info(f"[Crawl4AI] Depth: {result.metadata.get('depth', 0)}")
-
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=100)
-            batch = []
-            batch_size = 10
-            for r_idx, result in enumerate(results):
-                text = getattr(result, "markdown", None)
-                if text and hasattr(text, "raw_markdown"):
-                    text = text.raw_markdown
-                if not text:
-                    text = getattr(result, "cleaned_html", "") or ""
-                if not text.strip():
-                    continue
-                page_title = getattr(result, "title", "No title")
-                if page_title == "No title" or not page_title.strip():
-                    from urllib.parse import urlparse
-                    parsed_url = urlparse(result.url)
-                    if parsed_url.path and parsed_url.path != '/':
-                        path_parts = [part for part in parsed_url.path.split('/') if part]
-                        if path_parts:
-                            page_title = path_parts[-1].replace('-', ' ').replace('_', ' ').title()
-                        else:
-                            page_title = f"Page from {parsed_url.netloc}"
-                    else:
-                        page_title = f"Homepage - {parsed_url.netloc}"
-                chunks = text_splitter.split_text(text)
-                logger.info(f"[Crawl4AI] Split content from {result.url} into {len(chunks)} chunks")
-                for i, chunk in enumerate(chunks):
-                    if len(batch) % batch_size == 0 and len(batch) > 0:
-                        client.upsert(collection_name=collection_name, points=batch)
-                        stored_chunks += len(batch)
-                        batch = []
-                        logger.info(f"[Crawl4AI] Progressive upsert: {stored_chunks} chunks stored so far (page {r_idx+1}/{len(results)})")
-                    embedding = model.encode(chunk).tolist()
-                    uid = hashlib.md5((result.url + chunk[:200] + str(i)).encode()).hexdigest()
-                    batch.append(PointStruct(
-                        id=uid,
-                        vector=embedding,
-                        payload={
-                            "url": result.url, 
-                            "depth": result.metadata.get("depth", 0), 
-                            "text": chunk,
-                            "title": page_title,
-                            "metadata": result.metadata,
-                            "chunk_index": i,
-                            "total_chunks": len(chunks),
-                            "source_type": "web_crawled"
-                        }
-                    ))
-                stored_pages += 1
-            # Final upsert for remaining batch
-            if batch:
-                client.upsert(collection_name=collection_name, points=batch)
-                stored_chunks += len(batch)
-                logger.info(f"[Crawl4AI] Final upsert: {stored_chunks} chunks stored in total from {stored_pages} pages")
-    except asyncio.TimeoutError:
-        logger.warning(f"[Crawl4AI] Crawling timed out. Returning partial results. Chunks so far: {stored_chunks}, pages: {stored_pages}")
+                logger.info(f"[Crawl4AI] Crawled {page_url} (Depth: {page_depth})")
+                await page_queue.put((result, page_title))
+        await page_queue.put(None)
+
+    def page_text(result) -> str:
+        text = getattr(result, "markdown", None)
+        if text and hasattr(text, "raw_markdown"):
+            text = text.raw_markdown
+        if not text:
+            text = getattr(result, "cleaned_html", "") or ""
+        return text
+
+    def pages_points(pages: list[tuple]) -> list[PointStruct]:
+        page_chunks = []
+        for result, _, text in pages:
+            chunks = text_splitter.split_text(text)
+            logger.info(f"[Crawl4AI] Split content from {result.url} into {len(chunks)} chunks")
+            page_chunks.append(chunks)
+        # Encode the chunks of all waiting pages in one batched forward pass (cached chunks are skipped)
+        embeddings = embed_cache.get_or_encode_many(
+            EMBEDDING_CACHE_MODEL, [chunk for chunks in page_chunks for chunk in chunks], _encode_texts
+        )
+        # PointStruct validates vectors as lists, so convert the whole batch in one C-level call
+        vectors = iter(np.stack(embeddings).tolist() if embeddings else [])
+        return [
+            PointStruct(
+                # 128-bit hex digest, which Qdrant accepts as a UUID point id
+                id=xxhash.xxh128_hexdigest(result.url + chunk[:200] + str(i)),
+                vector=next(vectors),
+                payload={
+                    "url": result.url, 
+                    "depth": result.metadata.get("depth", 0), 
+                    "text": chunk,
+                    "title": page_title,
+                    "metadata": result.metadata,
+                    "chunk_index": i,
+                    "total_chunks": len(chunks),
+                    "source_type": "web_crawled"
+                }
+            )
+            for (result, page_title, _), chunks in zip(pages, page_chunks)
+            for i, chunk in enumerate(chunks)
+        ]
+
+    async def embed_pages():
+        nonlocal stored_pages
+        crawl_done = False
+        while not crawl_done:
+            # Take every page already waiting (up to CRAWL_EMBED_BATCH_PAGES) so they share one encode call
+            items = [await page_queue.get()]
+            while len(items) < CRAWL_EMBED_BATCH_PAGES and not page_queue.empty():
+                items.append(page_queue.get_nowait())
+            if items[-1] is None:
+                crawl_done = True
+                items.pop()
+            pages = [(result, page_title, text) for result, page_title in items if (text := page_text(result)).strip()]
+            if not pages:
+                continue
+            # Chunking and encoding are CPU-bound; a worker thread keeps the crawl running meanwhile
+            await point_queue.put(await asyncio.to_thread(pages_points, pages))
+            stored_pages += len(pages)
+        for _ in range(QDRANT_UPLOAD_CONCURRENCY):
+            await point_queue.put(None)
+
+    async def upsert_points():
+        nonlocal stored_chunks
+        batch = []
+        while (points := await point_queue.get()) is not None:
+            batch.extend(points)
+            while len(batch) >= batch_size:
+                await asyncio.to_thread(client.upsert, collection_name=collection_name, points=batch[:batch_size])
+                query_cache.invalidate(collection_name)
+                stored_chunks += batch_size
+                batch = batch[batch_size:]
+                logger.info(f"[Crawl4AI] Progressive upsert: {stored_chunks} chunks stored so far ({stored_pages} pages)")
+        # Final upsert for remaining batch
+        if batch:
+            await asyncio.to_thread(client.upsert, collection_name=collection_name, points=batch)
+            query_cache.invalidate(collection_name)
+            stored_chunks += len(batch)
+        logger.info(f"[Crawl4AI] Upload worker done: {stored_chunks} chunks stored so far from {stored_pages} pages")
+
+    try:
+        # Pause HNSW indexing while chunks stream in so segments are indexed once afterwards, not rebuilt per batch
+        await asyncio.to_thread(
+            client.update_collection, collection_name=collection_name, optimizers_config=OptimizersConfigDiff(indexing_threshold=0)
+        )
+        # A couple of concurrent upsert workers keeps Qdrant busy without overloading it
+        uploaders = [upsert_points() for _ in range(QDRANT_UPLOAD_CONCURRENCY)]
+        stages = [asyncio.create_task(stage) for stage in (crawl_pages(), embed_pages(), *uploaders)]
+        try:
+            # Bounds the crawl and ingest only, so a timeout still leaves time to answer from what was stored
+            async with asyncio.timeout(CRAWL4AI_TIMEOUT_S):
+                await asyncio.gather(*stages)
+        finally:
+            # If one stage fails or the crawl is cancelled, stop the others instead of leaving them blocked on a queue
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            await asyncio.to_thread(
+                client.update_collection,
+                collection_name=collection_name,
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=QDRANT_INDEXING_THRESHOLD)
+            )
+        logger.info(f"[Crawl4AI] Crawled {len(crawled_urls)} pages in total, {stored_chunks} chunks stored: {crawled_urls}")
+    except TimeoutError:
+        logger.warning(f"[Crawl4AI] Crawling timed out after {CRAWL4AI_TIMEOUT_S} seconds. Returning partial results. Chunks so far: {stored_chunks}, pages: {stored_pages}")
         # Return partial results: search Qdrant for the query
-        query_vector = model.encode(query).tolist()
-        hits = client.search(collection_name=collection_name, query_vector=query_vector, limit=top_k)
-        context = "\n---\n".join([hit.payload["text"] for hit in hits])
+        hits = _search_cached(collection_name, query, top_k, PARTIAL_RESULTS_HIT_THRESHOLD, RAG_PARTIAL_SEARCH_PARAMS)
         # Build sources from Qdrant
-        sources = []
-        crawled_pages = {}
-        for hit in hits:
-            page_url = hit.payload["url"]
-            page_title = hit.payload.get("title", page_url)
-            chunk_index = hit.payload.get("chunk_index", 0)
-            total_chunks = hit.payload.get("total_chunks", 1)
-            from urllib.parse import urlparse, urlunparse
-            parsed_url = urlparse(page_url)
-            normalized_url = urlunparse((
-                parsed_url.scheme,
-                parsed_url.netloc,
-                parsed_url.path.rstrip('/') or '/',
-                parsed_url.params,
-                parsed_url.query,
-                parsed_url.fragment
-            ))
-            if normalized_url not in crawled_pages:
-                crawled_pages[normalized_url] = {
-                    "title": page_title if page_title != "No title" else f"Page from {parsed_url.netloc}",
-                    "url": page_url,
-                    "chunks_found": 0,
-                    "total_chunks": total_chunks
-                }
-            crawled_pages[normalized_url]["chunks_found"] += 1
-        for page_url, page_info in crawled_pages.items():
-            source = {
-                "title": page_info["title"],
-                "file": page_url,
-                "page": 1,
-                "link": page_url,
-                "description": f"Content from {page_info['chunks_found']}/{page_info['total_chunks']} chunks of this page",
-                "source_type": "web_crawled_chunked",
-                "chunks_found": page_info["chunks_found"],
-                "total_chunks": page_info["total_chunks"]
-            }
-            sources.append(source)
-            logger.info(f"[Crawl4AI] Created source for partial crawled page: {page_url}")
+        sources = _build_sources(hits, link_normalized=True)
+        logger.info(f"[Crawl4AI] Created {len(sources)} sources for partial crawled pages")
         # Return minimal answer
         return {
             "answer": "Partial answer due to timeout. This is based on currently crawled and indexed content.",
@@ -1243,47 +1502,10 @@ async def crawl4ai_and_answer(url: str, query: str, collection_name: str = "test
         }
 
     # Normal completion: Run semantic search
-    query_vector = model.encode(query).tolist()
-    hits = client.search(collection_name=collection_name, query_vector=query_vector, limit=top_k)
+    hits = _search_cached(collection_name, query, top_k)
     context = "\n---\n".join([hit.payload["text"] for hit in hits])
-    sources = []
-    crawled_pages = {}
-    for hit in hits:
-        page_url = hit.payload["url"]
-        page_title = hit.payload.get("title", page_url)
-        chunk_index = hit.payload.get("chunk_index", 0)
-        total_chunks = hit.payload.get("total_chunks", 1)
-        from urllib.parse import urlparse, urlunparse
-        parsed_url = urlparse(page_url)
-        normalized_url = urlunparse((
-            parsed_url.scheme,
-            parsed_url.netloc,
-            parsed_url.path.rstrip('/') or '/',
-            parsed_url.params,
-            parsed_url.query,
-            parsed_url.fragment
-        ))
-        if normalized_url not in crawled_pages:
-            crawled_pages[normalized_url] = {
-                "title": page_title if page_title != "No title" else f"Page from {parsed_url.netloc}",
-                "url": page_url,
-                "chunks_found": 0,
-                "total_chunks": total_chunks
-            }
-        crawled_pages[normalized_url]["chunks_found"] += 1
-    for page_url, page_info in crawled_pages.items():
-        source = {
-            "title": page_info["title"],
-            "file": page_url,
-            "page": 1,
-            "link": page_url,
-            "description": f"Content from {page_info['chunks_found']}/{page_info['total_chunks']} chunks of this page",
-            "source_type": "web_crawled_chunked",
-            "chunks_found": page_info["chunks_found"],
-            "total_chunks": page_info["total_chunks"]
-        }
-        sources.append(source)
-        logger.info(f"[Crawl4AI] Created source for crawled page: {page_url}")
+    sources = _build_sources(hits, link_normalized=True)
+    logger.info(f"[Crawl4AI] Created {len(sources)} sources for crawled pages")
 
     prompt = f"""
     You are a helpful assistant. Use the following context to answer.
@@ -1296,87 +1518,24 @@ async def crawl4ai_and_answer(url: str, query: str, collection_name: str = "test
 
     ### Answer
     """
-    answer, _ = call_openrouter(prompt)
+    # Run the blocking LLM call off the event loop so other crawls and requests on it keep progressing
+    answer, _ = await asyncio.to_thread(call_openrouter, prompt)
     return {"answer": answer, "sources": sources}
 
 def crawl4ai_sync(url: str, query: str, collection_name: str = "testing", depth: int = 2, max_pages: int = 20, top_k: int = 3):
     """
     Synchronous wrapper for Crawl4AI crawling and RAG answering.
-    Handles timeouts and returns partial results from Qdrant if timeout occurs.
+    crawl4ai_and_answer bounds the crawl itself and returns partial results from Qdrant on timeout.
     """
     try:
-        # Always create a new event loop in a separate thread to avoid conflicts
-        import concurrent.futures
-        import threading
-        
-        def run_in_thread():
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            try:
-                # Increased timeout to 1200s (20min)
-                return new_loop.run_until_complete(
-                    asyncio.wait_for(
-                        crawl4ai_and_answer(url, query, collection_name, depth, max_pages, top_k),
-                        timeout=1200
-                    )
-                )
-            finally:
-                new_loop.close()
-                
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(run_in_thread)
-            try:
-                # Increased thread execution timeout to 1500s (25min)
-                return future.result(timeout=1500)
-            except concurrent.futures.TimeoutError:
-                logger.warning(f"[Crawl4AI] Thread execution timed out after 1500 seconds, returning partial results from Qdrant.")
-                # Query Qdrant for partial results
-                query_vector = model.encode(query).tolist()
-                hits = client.search(collection_name=collection_name, query_vector=query_vector, limit=top_k)
-                context = "\n---\n".join([hit.payload["text"] for hit in hits])
-                sources = []
-                crawled_pages = {}
-                for hit in hits:
-                    page_url = hit.payload["url"]
-                    page_title = hit.payload.get("title", page_url)
-                    chunk_index = hit.payload.get("chunk_index", 0)
-                    total_chunks = hit.payload.get("total_chunks", 1)
-                    from urllib.parse import urlparse, urlunparse
-                    parsed_url = urlparse(page_url)
-                    normalized_url = urlunparse((
-                        parsed_url.scheme,
-                        parsed_url.netloc,
-                        parsed_url.path.rstrip('/') or '/',
-                        parsed_url.params,
-                        parsed_url.query,
-                        parsed_url.fragment
-                    ))
-                    if normalized_url not in crawled_pages:
-                        crawled_pages[normalized_url] = {
-                            "title": page_title if page_title != "No title" else f"Page from {parsed_url.netloc}",
-                            "url": page_url,
-                            "chunks_found": 0,
-                            "total_chunks": total_chunks
-                        }
-                        crawled_pages[normalized_url]["chunks_found"] += 1
-                for page_url, page_info in crawled_pages.items():
-                    source = {
-                        "title": page_info["title"],
-                        "file": page_url,
-                        "page": 1,
-                        "link": page_url,
-                        "description": f"Content from {page_info['chunks_found']}/{page_info['total_chunks']} chunks of this page",
-                        "source_type": "web_crawled_chunked",
-                        "chunks_found": page_info["chunks_found"],
-                        "total_chunks": page_info["total_chunks"]
-                    }
-                    sources.append(source)
-                    logger.info(f"[Crawl4AI] Created source for partial crawled page: {page_url}")
-                return {
-                    "answer": "Partial answer due to timeout. This is based on currently crawled and indexed content.",
-                    "sources": sources
-                }
-                
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(crawl4ai_and_answer(url, query, collection_name, depth, max_pages, top_k))
+        # Called from a coroutine's thread (the sync /qa path); asyncio.run can't nest there,
+        # so the crawl gets its own loop on a worker thread
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, crawl4ai_and_answer(url, query, collection_name, depth, max_pages, top_k)).result()
     except Exception as e:
         logger.error(f"[Crawl4AI] Error in crawl4ai_sync: {e}")
         # Return error response